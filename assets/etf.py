@@ -1,4 +1,5 @@
 import pandas as pd
+from collections import OrderedDict
 from datetime import date
 from dateutil.relativedelta import relativedelta
 
@@ -8,15 +9,15 @@ from prisma.interfaces import (
     FmpCountryInterface,
 )
 from constants import (
-    SECTORS_COUNTRIES_DISPLAY_NUM,
-    SECTORS_COUNTRIES_MIN_WEIGHT,
     STD_DAYS_1M,
     STD_DAYS_3M,
     STD_DAYS_1Y,
     STD_DAYS_5Y,
     WINDOW_MULTIPLIER,
+    PRICE_HORIZONS,
 )
-from prisma.utils import ConvDateSeries, convert_countries_to_codes
+from prisma.utils import BatchConvDateSeries, RollingConvDateSeries, convert_countries_to_codes
+from prisma.utils.profiling import profiler
 
 
 class Asset:
@@ -24,12 +25,20 @@ class Asset:
         self.symbol = symbol
         self.allow_outdated = allow_outdated
 
-    def get_history_span(self):
+    @staticmethod
+    def get_history_span():
         end_date = date.today()
         half_window = WINDOW_MULTIPLIER * STD_DAYS_5Y
         start_date = end_date - relativedelta(years=5) - relativedelta(days=half_window) - relativedelta(days=7)
         return start_date, end_date
 
+    def fetch(self, executor, *calls):
+        # run (function, args...) calls on the executor if given, keeping the order of results
+        if executor is None:
+            return [fn(*args) for fn, *args in calls]
+        futures = [executor.submit(fn, *args) for fn, *args in calls]
+        return [future.result() for future in futures]
+
     def append(self, lhs, rhs):
         if rhs:
             for name, weight in rhs.items():
@@ -38,66 +47,185 @@ class Asset:
                 else:
                     lhs[name] = weight
 
-    def find_top(self, x, nlargest=SECTORS_COUNTRIES_DISPLAY_NUM, min_weight=SECTORS_COUNTRIES_MIN_WEIGHT):
-        if not x:
-            return ""
-        largest = pd.DataFrame.from_dict(x, orient="index", columns=["weight"]).nlargest(nlargest, "weight")
-        largest = largest[largest.weight >= min_weight]
-
-        top_selection = []
-        for name, weight in largest.itertuples():
-            new_name = f"{name}"
-            if weight < 0.99 and len(largest) > 1:
-                new_name += f"{weight:.1f}".strip("0")
-            top_selection.append(new_name)
-        return " ".join(top_selection)
-
-    def filter_price(self, price):
-        back_5y = date.today() - relativedelta(years=5)
-        back_1y = date.today() - relativedelta(years=1)
-        back_3m = date.today() - relativedelta(months=3)
-        back_1m = date.today() - relativedelta(months=1)
-        today = date.today()
-
-        dates = [back_1m, back_3m, back_1y, back_5y]
+    @staticmethod
+    def filter_prices(prices, today=None):
+        """
+        Compute filtered price changes for all horizons of a price matrix (trading days x assets)
+        """
+        today = today or date.today()
         stds = [STD_DAYS_1M, STD_DAYS_3M, STD_DAYS_1Y, STD_DAYS_5Y]
-        names = ["1M", "3M", "1Y", "5Y"]
+        names = PRICE_HORIZONS
         months = [1, 3, 12, 60]
+        price_filter = BatchConvDateSeries()
         price_change = {}
-        for m, day, std, name in zip(months, dates, stds, names):
-            price_filter = ConvDateSeries()
-            price_old = price_filter(price, day, std)
-            price_today = price_filter(price, today, std)
-            if price_old is None or price_today is None:
-                price_change[name] = None
-                continue
+        for m, std, name in zip(months, stds, names):
+            with profiler.timer("conv_date_series", horizon=name):
+                price_old, price_today = price_filter(prices, [today - relativedelta(months=m), today], std)
+            change = (price_today - price_old) / price_old
+            if m > 12:
+                change *= 12 / m
+            price_change[name] = change
+        return pd.DataFrame(price_change, index=prices.columns)
+
+    @staticmethod
+    def filter_price_panel(prices, dates):
+        """
+        Compute filtered price changes for all horizons as of every given date at once,
+        returning {horizon: (dates x assets)}. Only prices known at a date are used for it.
+        """
+        stds = [STD_DAYS_1M, STD_DAYS_3M, STD_DAYS_1Y, STD_DAYS_5Y]
+        names = PRICE_HORIZONS
+        months = [1, 3, 12, 60]
+        price_filter = RollingConvDateSeries()
+        dates = pd.DatetimeIndex(dates).normalize()
+        price_change = {}
+        for m, std, name in zip(months, stds, names):
+            with profiler.timer("rolling_conv_date_series", horizon=name):
+                # windows around the older dates end long before the date itself
+                price_old = price_filter(prices, std).reindex(dates - pd.DateOffset(months=m))
+                price_today = price_filter(prices, std, causal=True).reindex(dates)
+            price_old.index = dates
             change = (price_today - price_old) / price_old
             if m > 12:
                 change *= 12 / m
             price_change[name] = change
         return price_change
 
+    def filter_price(self, price):
+        return self.filter_prices(price.to_frame(name=self.symbol)).iloc[0].to_dict()
+
 
 class ETF(Asset):
-    def __init__(self, symbol, allow_outdated, countries=None, industries=None):
+    """
+    Fields are loaded lazily on first access, while the fields required by the given inputs
+    (rule inputs, such as stat columns, "sectors" or "countries") are prefetched in parallel
+    """
+
+    FIELDS = ("statistics", "price", "countries", "price_change")
+    # fields stored in parsed records, while prices are large and loaded lazily
+    RECORD_FIELDS = ("statistics", "countries", "price_change")
+
+    def __init__(
+        self, symbol, allow_outdated, countries=None, industries=None, executor=None, interfaces=None, inputs=None
+    ):
         super().__init__(symbol, allow_outdated)
+        self.istat, self.ihistory, self.icountries = interfaces or self.make_interfaces(self.allow_outdated)
+        self.user_countries = countries
+        self.industries = industries
+        self.loaded = {}
+        self.load(self.get_fields(inputs), executor)
+
+    @classmethod
+    def from_record(cls, symbol, allow_outdated, record, countries=None, industries=None, interfaces=None):
+        """
+        Asset with the fields of a parsed record that are still derived from the current cached records
+        """
+        asset = cls.__new__(cls)
+        Asset.__init__(asset, symbol, allow_outdated)
+        asset.istat, asset.ihistory, asset.icountries = interfaces or cls.make_interfaces(allow_outdated)
+        asset.user_countries = countries
+        asset.industries = industries
+        sources = asset.get_sources(record["fields"])
+        asset.loaded = {
+            field: value
+            for field, value in record["fields"].items()
+            if sources[field] is not None and sources[field] == record["sources"][field]
+        }
+        return asset
+
+    def to_record(self):
+        """
+        Parsed record of the loaded fields, together with the keys of the cached records they are derived from
+        """
+        fields = {field: value for field, value in self.loaded.items() if field in self.RECORD_FIELDS}
+        sources = self.get_sources(fields)
+        fields = {field: value for field, value in fields.items() if sources[field] is not None}
+        return {"fields": fields, "sources": sources}
+
+    def get_sources(self, fields):
+        sources = {}
+        for field in fields:
+            if field == "statistics":
+                sources[field] = self.istat.get_record_key(self.istat.name, self.symbol, "US")
+            elif field == "countries":
+                sources[field] = self.icountries.get_record_key(self.icountries.name, self.symbol, "US")
+            elif field == "price_change":
+                key = self.ihistory.get_record_key(self.ihistory.name, self.symbol, "US")
+                # filtered changes also depend on the date they are computed for
+                sources[field] = key and (key, str(date.today()))
+        return sources
+
+    @classmethod
+    def get_fields(cls, inputs=None):
+        if inputs is None:
+            return cls.FIELDS
+        fields = ["statistics"]  # always needed for displaying
+        if "countries" in inputs:
+            fields.append("countries")
+        if any(horizon in inputs for horizon in PRICE_HORIZONS):
+            fields.append("price_change")
+        return fields
+
+    def load(self, fields, executor=None):
+        # the three providers are independent, so they can be queried in parallel
+        pulled = [field for field in ("statistics", "price", "countries") if field not in self.loaded]
+        pulled = [field for field in pulled if field in fields or (field == "price" and "price_change" in fields)]
+        results = self.fetch(executor, *[(getattr(self, f"pull_{field}"),) for field in pulled])
+        self.loaded.update(zip(pulled, results))
+        for field in fields:
+            self.get(field)
+
+    def get(self, field):
+        if field not in self.loaded:
+            self.loaded[field] = getattr(self, f"pull_{field}")()
+        return self.loaded[field]
+
+    def pull_statistics(self):
+        stat, sectors = self.istat.pull(self.symbol, "US")
+        # append user-defined knowledge
+        self.append(sectors, self.industries)
+        return stat, sectors
 
-        istat = RapidApiStatisticsInterface(allow_outdated=self.allow_outdated)
-        self.stat, self.sectors = istat.pull(self.symbol, "US")
-
-        ihistory = YFinanceHistoryInterface(allow_outdated=self.allow_outdated)
+    def pull_price(self):
         start_date, end_date = self.get_history_span()
-        self.price = ihistory.pull(self.symbol, "US", start_date, end_date)
-
-        icountries = FmpCountryInterface(allow_outdated=self.allow_outdated)
-        self.countries = icountries.pull(self.symbol, "US")
+        return self.ihistory.pull(self.symbol, "US", start_date, end_date)
 
+    def pull_countries(self):
+        countries = self.icountries.pull(self.symbol, "US")
         # append user-defined knowledge
-        self.append(self.sectors, industries)
-        self.append(self.countries, convert_countries_to_codes(countries))
-
-        self.stat["Sectors"] = self.find_top(self.sectors)
-        self.stat["Countries"] = self.find_top(self.countries)
-
-        price_change = self.filter_price(self.price)
-        self.stat.update(price_change)
+        self.append(countries, convert_countries_to_codes(self.user_countries))
+        return countries
+
+    def pull_price_change(self):
+        return self.filter_price(self.price)
+
+    @property
+    def stat(self):
+        stat = OrderedDict(self.get("statistics")[0])
+        if "price_change" in self.loaded:
+            stat.update(self.loaded["price_change"])
+        return stat
+
+    @property
+    def sectors(self):
+        return self.get("statistics")[1]
+
+    @property
+    def countries(self):
+        return self.get("countries")
+
+    @property
+    def price(self):
+        return self.get("price")
+
+    @property
+    def price_change(self):
+        return self.get("price_change")
+
+    @staticmethod
+    def make_interfaces(allow_outdated, **kwargs):
+        return (
+            RapidApiStatisticsInterface(allow_outdated=allow_outdated, **kwargs),
+            YFinanceHistoryInterface(allow_outdated=allow_outdated, **kwargs),
+            FmpCountryInterface(allow_outdated=allow_outdated, **kwargs),
+        )
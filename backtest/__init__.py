@@ -0,0 +1,5 @@
+from prisma.backtest.backtest import Backtest
+
+__all__ = [
+    "Backtest",
+]
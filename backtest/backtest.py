@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import logging
+from functools import reduce
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
+
+from prisma.main import Portfolio
+from prisma.assets import ETF
+from prisma.screener import Screener
+from prisma.constants import (
+    PRICE_HORIZONS,
+    STD_DAYS_5Y,
+    WINDOW_MULTIPLIER,
+    BACKTEST_YEARS,
+    BACKTEST_HORIZON,
+    BACKTEST_DECILES,
+)
+
+
+class Backtest:
+    """
+    Scores the assets on every trading day of a past period with the price-based rules,
+    and relates the ranking to the returns that followed it
+    """
+
+    def __init__(self, settings_file, assets_file, years=BACKTEST_YEARS, allow_outdated=False, jobs=1, interfaces=None):
+        settings = Portfolio.read_yaml(settings_file)
+        # only price changes are known for the past, the other statistics are today's
+        self.rules = [rule for rule in Screener(settings["Rules"]).rules if set(rule.inputs) <= set(PRICE_HORIZONS)]
+        assert self.rules, "No price-based rules are configured"
+        requests = Portfolio.parse_assets(Portfolio.read_yaml(assets_file))
+        self.symbols = list(dict.fromkeys(name for _, name, _ in requests))
+        self.years = years
+        self.jobs = jobs
+        _, self.ihistory, _ = interfaces or ETF.make_interfaces(allow_outdated)
+
+    def load_prices(self, start_date, end_date):
+        """
+        Return close prices (trading days x assets) from the history cache, fetching what is missing
+        """
+
+        def pull(symbol):
+            try:
+                return self.ihistory.pull(symbol, "US", start_date, end_date)
+            except Exception:
+                logging.exception("Failed to load the history of %s, skipping it", symbol)
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            prices = dict(zip(self.symbols, executor.map(pull, self.symbols)))
+        prices = {symbol: price for symbol, price in prices.items() if price is not None and not price.empty}
+        assert prices, "Price histories were not found"
+        return pd.concat(prices, axis=1).sort_index()
+
+    def forward_returns(self, prices, dates, horizon):
+        # returns over the next horizon trading days, bought at the close of every date
+        closes = prices.ffill().reindex(dates)
+        return closes.shift(-horizon) / closes - 1
+
+    def decile_stats(self, scores, returns, deciles=BACKTEST_DECILES):
+        """
+        Return forward return statistics of every decile of the daily ranking, the last decile scoring the highest
+        """
+        ranks = scores.rank(axis=1, pct=True)
+        decile = np.ceil(ranks * deciles).clip(1, deciles)
+        table = pd.DataFrame({"Decile": decile.stack(), "Return": returns.reindex_like(scores).stack()}).dropna()
+        grouped = table.groupby("Decile")["Return"]
+        stats = pd.DataFrame(
+            {
+                "Mean return": grouped.mean(),
+                "Median return": grouped.median(),
+                "Hit rate": grouped.apply(lambda returns: (returns > 0).mean()),
+                "Observations": grouped.size(),
+            }
+        )
+        stats.index = stats.index.astype(int)
+        return stats
+
+    def run(self, horizon=BACKTEST_HORIZON, end_date=None):
+        """
+        Return the total score panel (dates x assets), panels of every rule and decile statistics
+        of the forward returns over the horizon (in trading days)
+        """
+        end_date = end_date or date.today()
+        start_date = end_date - relativedelta(years=self.years)
+        # the 5-year change of the first date needs prices from 5 years and a filter window before it
+        history_start = (
+            start_date
+            - relativedelta(years=5)
+            - relativedelta(days=WINDOW_MULTIPLIER * STD_DAYS_5Y)
+            - relativedelta(days=7)
+        )
+        prices = self.load_prices(history_start, end_date)
+        dates = prices.index[prices.index >= pd.Timestamp(start_date)]
+
+        price_change = ETF.filter_price_panel(prices, dates)
+        rule_scores = {rule.name: rule.panel(price_change) for rule in self.rules}
+        # missing rule scores count as zero, as in Screener, unless an asset has no scores at all
+        scores = reduce(lambda total, panel: total.add(panel, fill_value=0), rule_scores.values())
+        scores = scores.where(sum(panel.notna() for panel in rule_scores.values()) > 0)
+
+        stats = self.decile_stats(scores, self.forward_returns(prices, dates, horizon))
+        return scores, rule_scores, stats
@@ -0,0 +1,5 @@
+from prisma.batch.batch import BatchScreener
+
+__all__ = [
+    "BatchScreener",
+]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import logging
+from pathlib import Path
+
+from prisma.main import Portfolio
+from prisma.screener import Screener
+from prisma.utils.output import write_table
+
+
+class BatchScreener:
+    """
+    Screens several assets files in one run. Every distinct asset is loaded once and shared
+    by the portfolios of all files that list it.
+    """
+
+    def __init__(self, settings_file, assets_files, allow_outdated=False, jobs=1, interfaces=None):
+        self.settings = Portfolio.read_yaml(settings_file)
+        self.assets_files = self.expand(assets_files)
+        assert self.assets_files, "Assets files were not found"
+        self.allow_outdated = allow_outdated
+        self.jobs = jobs
+        self.interfaces = interfaces
+
+    @staticmethod
+    def expand(patterns):
+        """
+        Resolve glob patterns to a list of files, keeping the given order and dropping duplicates
+        """
+        files = []
+        for pattern in patterns:
+            for filename in sorted(glob.glob(pattern)) or [pattern]:
+                if filename not in files:
+                    files.append(filename)
+        return files
+
+    def run(self):
+        """
+        Return {assets file: (portfolio, scores)} for every file with at least one loaded asset
+        """
+        configs = {filename: Portfolio.read_yaml(filename) for filename in self.assets_files}
+        screeners = {
+            # a file may define its own rules instead of the ones from the settings
+            filename: Screener(rules=config.get("Rules") or self.settings["Rules"])
+            for filename, config in configs.items()
+        }
+        inputs = set().union(*(screener.inputs() for screener in screeners.values()))
+
+        keys = {}
+        requests = {}
+        for filename, config in configs.items():
+            keys[filename] = []
+            for request in Portfolio.parse_assets(config):
+                key = Portfolio.get_asset_key(*request)
+                keys[filename].append(key)
+                requests.setdefault(key, request)
+        logging.info("Loading %d distinct assets of %d files", len(requests), len(self.assets_files))
+        loaded = Portfolio.load_assets(
+            list(requests.values()), self.allow_outdated, self.jobs, interfaces=self.interfaces, inputs=inputs
+        )
+        assets = {key: asset for key, asset in zip(requests, loaded) if asset is not None}
+
+        results = {}
+        for filename, screener in screeners.items():
+            portfolio_assets = [assets[key] for key in dict.fromkeys(keys[filename]) if key in assets]
+            if not portfolio_assets:
+                logging.warning("No assets of %s were loaded, skipping it", filename)
+                continue
+            settings = dict(self.settings, Rules=configs[filename].get("Rules") or self.settings["Rules"])
+            portfolio = Portfolio.from_assets(settings, portfolio_assets)
+            results[filename] = (portfolio, screener(portfolio))
+        return results
+
+    def write(self, results, output_dir, output_format="csv"):
+        """
+        Store scores and statistics of every portfolio in a file named after its assets file
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        names = set()
+        filenames = []
+        for assets_file, (portfolio, scores) in results.items():
+            stem = name = Path(assets_file).stem
+            count = 0
+            while name in names:
+                # files with the same name from different directories
+                count += 1
+                name = f"{stem}-{count}"
+            names.add(name)
+            filename = os.path.join(output_dir, f"{name}.{output_format}")
+            write_table(portfolio.scores_table(scores), output_format, filename)
+            filenames.append(filename)
+        return filenames
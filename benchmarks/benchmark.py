@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from ruamel.yaml import YAML
+import pandas as pd
+from tabulate import tabulate
+
+from prisma.main import Portfolio
+from prisma.assets import ETF
+from prisma.screener import Screener
+from prisma.interfaces import OfflineProvider
+from prisma.interfaces.cache import Cache, MemoryCache, SqliteBackend, ColumnarCache, ParsedCache
+from prisma.constants import PROJECT_DIR
+
+
+def timed(fn, repeat=1):
+    # the best of several runs is the least noisy estimate
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def get_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True)
+        return output.stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Benchmark:
+    """
+    End-to-end benchmark of a synthetic universe served by an offline provider
+    """
+
+    def __init__(self, size, settings_file, latency=0.0, error_rate=0.0, jobs=1, repeat=3):
+        self.size = size
+        self.settings_file = settings_file
+        self.provider = OfflineProvider(latency=latency, error_rate=error_rate)
+        self.jobs = jobs
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, case, seconds):
+        self.results.append({"case": case, "size": self.size, "seconds": seconds})
+
+    def write_assets(self, directory):
+        assets_file = os.path.join(directory, "assets.yml")
+        symbols = [f"SYN{i:05d}" for i in range(self.size)]
+        with open(assets_file, "w") as file:
+            YAML(typ="safe").dump({"ETF": symbols}, file)
+        return assets_file
+
+    def load(self, assets_file, backend, history_cache, parsed_cache=None):
+        # a new memory tier for every load, so that warm loads read the disk cache
+        interfaces = self.provider.make_interfaces(
+            cache=Cache(backend, memory=MemoryCache()), history_cache=history_cache
+        )
+        return Portfolio(
+            self.settings_file, assets_file, False, jobs=self.jobs, interfaces=interfaces, parsed_cache=parsed_cache
+        )
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            assets_file = self.write_assets(directory)
+            backend = SqliteBackend(os.path.join(directory, "cache.sqlite"))
+            history_cache = ColumnarCache(os.path.join(directory, "columnar"))
+
+            seconds, _ = timed(lambda: self.load(assets_file, backend, history_cache))
+            self.record("load_cold", seconds)
+            seconds, portfolio = timed(lambda: self.load(assets_file, backend, history_cache), self.repeat)
+            self.record("load_warm", seconds)
+            parsed_cache = ParsedCache(os.path.join(directory, "parsed.sqlite"))
+            self.load(assets_file, backend, history_cache, parsed_cache)
+            seconds, _ = timed(lambda: self.load(assets_file, backend, history_cache, parsed_cache), self.repeat)
+            self.record("load_parsed", seconds)
+
+            _, ihistory, _ = self.provider.make_interfaces(cache=Cache(backend), history_cache=history_cache)
+            start_date, end_date = ETF.get_history_span()
+            prices = pd.concat(
+                {symbol: ihistory.pull(symbol, "US", start_date, end_date) for symbol in portfolio.stat.index}, axis=1
+            )
+            seconds, _ = timed(lambda: ETF.filter_prices(prices), self.repeat)
+            self.record("filter_price", seconds)
+
+            # without the rule cache, as the repeats would only measure its hits
+            screener = Screener(rules=portfolio.settings["Rules"], cache=None)
+            for rule in screener.rules:
+                seconds, _ = timed(lambda: rule(portfolio), self.repeat)
+                self.record(f"rule_{type(rule).__name__}", seconds)
+            seconds, _ = timed(lambda: screener(portfolio), self.repeat)
+            self.record("screener", seconds)
+        return self.results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Prisma on synthetic universes served offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="Universe sizes")
+    parser.add_argument("--settings", default=os.path.join(PROJECT_DIR, "settings.yaml"), help="Settings file")
+    parser.add_argument("--latency", type=float, default=0.0, help="Synthetic latency per request, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of failing requests")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of assets to load concurrently")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of repeats of the warm cases")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        benchmark = Benchmark(size, args.settings, args.latency, args.error_rate, args.jobs, args.repeat)
+        results.extend(benchmark.run())
+
+    report = {
+        "commit": get_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    table = pd.DataFrame(results).pivot(index="case", columns="size", values="seconds")
+    print(tabulate(table, headers="keys", tablefmt="psql", floatfmt=".4f"))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import argparse
+import subprocess
+import pandas as pd
+from tabulate import tabulate
+
+# modules that cached runs and cache maintenance must not load
+DEFERRED_MODULES = ["yfinance", "yahoofinance", "requests", "pycountry"]
+
+# screens and cache maintenance commands both start from main
+STARTUP_CASES = {
+    "main": "prisma.main",
+    "daemon_client": "prisma.daemon",
+}
+
+
+def import_times(module):
+    """
+    Return {module: cumulative import time in seconds} reported by -X importtime for a fresh interpreter
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in output.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def measure(module, repeat):
+    # the best of several runs is the least noisy estimate
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or times[module] < best[module]:
+            best = times
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of Prisma entry points.")
+    parser.add_argument("--budget", type=float, default=0.6, help="Allowed import time of every case, in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of interpreter starts per case")
+    parser.add_argument("--top", type=int, default=10, help="Number of the slowest imports to show")
+    args = parser.parse_args()
+
+    failures = []
+    for case, module in STARTUP_CASES.items():
+        times = measure(module, args.repeat)
+        top_level = {name: seconds for name, seconds in times.items() if "." not in name}
+        slowest = pd.Series(top_level).sort_values(ascending=False).head(args.top)
+        print(f"{case}: import {module} took {times[module]:.3f} s (budget {args.budget:.3f} s)")
+        print(tabulate(slowest.to_frame("seconds"), headers="keys", tablefmt="psql", floatfmt=".4f"))
+
+        if times[module] > args.budget:
+            failures.append(f"{case} exceeds the budget")
+        loaded = [name for name in DEFERRED_MODULES if name in times]
+        if loaded:
+            failures.append(f"{case} loads {', '.join(loaded)}")
+
+    if failures:
+        sys.exit("\n".join(failures))
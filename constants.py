@@ -3,7 +3,32 @@ import os
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = "data"
 CACHE_DIR = os.path.join(PROJECT_DIR, DATA_DIR, "cache")
+CACHE_DB = os.path.join(PROJECT_DIR, DATA_DIR, "cache.sqlite")
+CACHE_BACKEND = "sqlite"  # "sqlite" or "pickle"
+COLUMNAR_CACHE_DIR = os.path.join(CACHE_DIR, "columnar")
+PARSED_CACHE_DB = os.path.join(PROJECT_DIR, DATA_DIR, "parsed.sqlite")
+# parsed records are dropped whenever this version or any of these sources change
+PARSED_CACHE_SCHEMA = 1
+PARSED_CACHE_SOURCES = [
+    "constants.py",
+    "interfaces/interface.py",
+    "assets/etf.py",
+    "utils/utils.py",
+    "utils/filters.py",
+]
+# corrupt records are moved here instead of being read again
+CACHE_QUARANTINE_DIR = os.path.join(PROJECT_DIR, DATA_DIR, "quarantine")
+# cross-process fetch leases, hashed into a fixed number of lock files
+CACHE_LOCK_DIR = os.path.join(PROJECT_DIR, DATA_DIR, "locks")
+CACHE_LEASE_SLOTS = 256
+CACHE_LEASE_TIMEOUT = 300  # In seconds, after that the fetch goes on without the lease
+CACHE_LEASE_POLL = 0.05  # In seconds
+SQLITE_BUSY_TIMEOUT = 30  # In seconds
+MEMORY_CACHE_MAX_ENTRIES = 4096
+MEMORY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+SQLITE_ACCESS_BUFFER_SIZE = 256  # Record reads written to the database at once
 WALLET_FILE = os.path.join(PROJECT_DIR, DATA_DIR, "wallet.json")
+COUNTRY_ALIASES_FILE = os.path.join(PROJECT_DIR, DATA_DIR, "country_aliases.json")
 
 
 RAPIDAPI_SECTORS_MAP = {
@@ -20,15 +45,94 @@ RAPIDAPI_SECTORS_MAP = {
     "healthcare": "H",
 }
 
+# Country spellings used by FMP (and common names) that pycountry does not resolve exactly
+FMP_COUNTRY_ALIASES = {
+    "Korea": "KR",
+    "Korea (the Republic of)": "KR",
+    "Korea, Republic of": "KR",
+    "South Korea": "KR",
+    "Taiwan": "TW",
+    "Taiwan (Province of China)": "TW",
+    "Russia": "RU",
+    "Russian Federation (the)": "RU",
+    "United States of America (the)": "US",
+    "United Kingdom of Great Britain and Northern Ireland (the)": "GB",
+    "Netherlands (the)": "NL",
+    "Philippines (the)": "PH",
+    "Cayman Islands (the)": "KY",
+    "Vietnam": "VN",
+    "Turkey": "TR",
+    "Czech Republic": "CZ",
+    "Macau": "MO",
+    "Macao": "MO",
+    "Iran": "IR",
+}
+
+# Maximum number of simultaneous network requests per provider
+DEFAULT_PROVIDER_CONCURRENCY = 4
+PROVIDER_CONCURRENCY = {
+    "rapidapi_statistics": 4,
+    "rapidapi_history": 4,
+    "yahoofinance_history": 4,
+    "yfinance_history": 1,  # yfinance.download keeps its results in module-level state
+    "fmp": 4,
+}
+# Interfaces sharing a transport, whose connection pool serves all of their simultaneous requests
+TRANSPORT_INTERFACES = {
+    "rapidapi": ["rapidapi_statistics", "rapidapi_history"],
+    "fmp": ["fmp"],
+}
+
+# Sustained requests per second and burst size of every provider transport
+DEFAULT_PROVIDER_RATE_LIMIT = (2.0, 2)
+PROVIDER_RATE_LIMITS = {
+    "rapidapi": (5.0, 5),
+    "fmp": (4.0, 4),
+}
+HTTP_TIMEOUT = 15  # In seconds
+HTTP_RETRIES = 4
+HTTP_BACKOFF = 0.5  # In seconds, doubled with every retry
+HTTP_MAX_BACKOFF = 30  # In seconds
+
+# Memory budget for memoized rule outputs
+RULE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Resident mode
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+DAEMON_POLL_INTERVAL = 1.0  # In seconds
+
+# Histories requested in one call when warming the cache for many assets
+HISTORY_CHUNK_SIZE = 100
 
-def format_as_million(num):
-    if num is not None:
-        return f"{num/1000000:.2f}M"
+# Failed or empty responses are not requested again for this long
+NEGATIVE_CACHE_TTL_DAYS = 7
+
+# Cache retention, applied by --compact and automatically once per interval
+DEFAULT_CACHE_KEEP_VERSIONS = 3
+CACHE_KEEP_VERSIONS = {
+    # every history record contains the older ones
+    "yfinance_history": 1,
+}
+DEFAULT_CACHE_MAX_AGE_DAYS = 90
+CACHE_MAX_AGE_DAYS = {
+    "rapidapi_statistics": 30,
+    "yfinance_history": 30,
+    "fmp": 180,
+    "failure": NEGATIVE_CACHE_TTL_DAYS,
+}
+CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+CACHE_COMPACT_INTERVAL_HOURS = 24
+CACHE_COMPACT_STAMP = os.path.join(PROJECT_DIR, DATA_DIR, "last_compaction")
+
+
+# Formatters take a whole column, missing values stay empty
+def format_as_million(column):
+    return column.astype(float).div(1000000).map("{:.2f}M".format, na_action="ignore")
 
 
-def format_as_percent(num, decimal_digits=1):
-    if num is not None:
-        return round(num * 100, decimal_digits)
+def format_as_percent(column, decimal_digits=1):
+    return column.astype(float).mul(100).round(decimal_digits)
 
 
 HEADER_FORMAT = {
@@ -61,9 +165,28 @@ HEADER_FORMAT = {
     },
 }
 
+OUTPUT_CHUNK_ROWS = 1000  # Rows written at once by machine-readable outputs
+
 SECTORS_COUNTRIES_DISPLAY_NUM = 3  # In counts
 SECTORS_COUNTRIES_MIN_WEIGHT = 0.1  # In %
 
+PRICE_HORIZONS = ["1M", "3M", "1Y", "5Y"]
+# stat columns that formula rules may name as they are, other columns are quoted with backticks
+FORMULA_COLUMNS = ["P/E", "P/S", "Yield", "Volume", "TER", "Price", "50MA", "200MA", *PRICE_HORIZONS]
+
+# Backtests of the price-based rules
+BACKTEST_YEARS = 3
+BACKTEST_HORIZON = 21  # Forward returns are measured over this many trading days
+BACKTEST_DECILES = 10
+
+# Weight tuning, candidate weights scale every configured weight by a factor within 1 ± spread
+TUNING_CANDIDATES = 5000
+TUNING_SPREAD = 1.0
+TUNING_TOP = 20  # Top assets compared between weightings
+TUNING_OBJECTIVE = "1Y"  # Stat column averaged over the best scored assets
+TUNING_TOP_SHARE = 0.1  # Share of the best scored assets the objective is averaged over
+TUNING_CHUNK_CELLS = 5000000  # Total scores (assets x candidates) computed at once
+
 # Standard deviation for filtering at specific time back (in days)
 WINDOW_MULTIPLIER = 1
 STD_DAYS_5Y = 60  # 121 * WINDOW_MULTIPLIER days window
@@ -0,0 +1,6 @@
+from prisma.daemon.daemon import ScreenerDaemon, query
+
+__all__ = [
+    "ScreenerDaemon",
+    "query",
+]
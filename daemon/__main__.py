@@ -0,0 +1,16 @@
+import argparse
+from tabulate import tabulate
+
+from prisma.daemon import query
+from prisma.constants import DAEMON_HOST, DAEMON_PORT
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the scores of a running Prisma daemon.")
+    parser.add_argument("command", nargs="?", default="scores", choices=["scores", "stat"], help="Table to show")
+    parser.add_argument("-n", "--top", type=int, default=None, help="Show only the top rows")
+    parser.add_argument("--host", default=DAEMON_HOST, help="Daemon host (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="Daemon port (default: %(default)s)")
+    args = parser.parse_args()
+
+    table = query(args.command, args.top, args.host, args.port)
+    print(tabulate(table, headers="keys", tablefmt="psql", numalign="right", stralign="right"))
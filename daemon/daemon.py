@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import os
+import copy
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+import pandas as pd
+from datetime import date
+
+from prisma.main import Portfolio
+from prisma.screener import Screener
+from prisma.interfaces.retention import Retention
+from prisma.constants import DAEMON_HOST, DAEMON_PORT, DAEMON_POLL_INTERVAL
+
+
+class ScreenerDaemon:
+    """
+    Keeps assets and rule scores in memory and re-evaluates only what is affected
+    when the settings or the assets file change. All assets are reloaded once a day.
+    """
+
+    def __init__(self, settings_file, assets_file, allow_outdated=False, jobs=1, interfaces=None, on_update=None):
+        self.settings_file = settings_file
+        self.assets_file = assets_file
+        self.allow_outdated = allow_outdated
+        self.jobs = jobs
+        self.interfaces = interfaces
+        self.on_update = on_update
+        self.assets = {}  # asset key -> asset
+        self.rules = {}  # rule key -> rules created from a settings entry
+        self.rule_scores = {}  # rule key -> scores of these rules
+        self.mtimes = {}
+        self.day = None  # date of the loaded assets, as histories and price changes move on every day
+        self.portfolio = None
+        self.scores = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresh(force=True)
+
+    def get_key(self, *items):
+        return json.dumps(items, sort_keys=True, default=str)
+
+    def changed(self, filename):
+        mtime = os.stat(filename).st_mtime_ns
+        changed = self.mtimes.get(filename) != mtime
+        self.mtimes[filename] = mtime
+        return changed
+
+    def refresh(self, force=False):
+        settings_changed = self.changed(self.settings_file)
+        assets_changed = self.changed(self.assets_file)
+        today = date.today()
+        day_changed = self.day != today
+        if not (force or settings_changed or assets_changed or day_changed):
+            return False
+        start = time.perf_counter()
+        # assets of another day are loaded again, they are then found in the cache records of today
+        known_assets = {} if day_changed else self.assets
+
+        settings = Portfolio.read_yaml(self.settings_file)
+        rules = {}
+        for config in settings["Rules"]:
+            key = self.get_key(config)
+            rules[key] = self.rules.get(key) or Screener.make_rules(config)
+        inputs = set().union(*(rule.inputs for entry in rules.values() for rule in entry))
+
+        requests = Portfolio.parse_assets(Portfolio.read_yaml(self.assets_file))
+        keys = [self.get_key(constructor.__name__, name, kwargs) for constructor, name, kwargs in requests]
+        new_requests = [(key, request) for key, request in zip(keys, requests) if key not in known_assets]
+        new_assets = Portfolio.load_assets(
+            [request for _, request in new_requests],
+            self.allow_outdated,
+            self.jobs,
+            interfaces=self.interfaces,
+            inputs=inputs,
+        )
+        loaded = {key: asset for (key, _), asset in zip(new_requests, new_assets) if asset is not None}
+
+        assets = {}
+        for key in keys:
+            asset = known_assets.get(key) or loaded.get(key)
+            if asset is None:
+                continue
+            try:
+                # rules added to the settings may need fields that were not loaded yet
+                asset.load(asset.get_fields(inputs))
+            except Exception:
+                logging.exception("Failed to load asset %s, skipping it", asset.symbol)
+                continue
+            assets[key] = asset
+        assert assets, "Assets were not found"
+
+        portfolio = Portfolio.from_assets(settings, list(assets.values()))
+        # rules are cross-sectional (e.g. normalized by the maximum), so a new universe affects all of them
+        universe_changed = day_changed or list(assets) != list(self.assets)
+        screener = Screener([])
+        rule_scores = {}
+        for key, entry in rules.items():
+            if universe_changed or key not in self.rule_scores:
+                # rules whose inputs did not change are still found in the rule cache
+                rule_scores[key] = [screener.evaluate(rule, portfolio) for rule in entry]
+            else:
+                rule_scores[key] = self.rule_scores[key]
+        scores = screener.combine(portfolio, [score for entry in rule_scores.values() for score in entry])
+
+        with self.lock:
+            self.assets, self.rules, self.rule_scores = assets, rules, rule_scores
+            self.portfolio, self.scores, self.day = portfolio, scores, today
+            # updates are handled on a copy, as displaying a portfolio reorders its statistics
+            update = copy.copy(portfolio), scores
+        logging.info("Scores updated in %.1f ms", 1000 * (time.perf_counter() - start))
+        if self.on_update:
+            self.on_update(*update)
+        return True
+
+    def watch(self, interval=DAEMON_POLL_INTERVAL):
+        while not self.stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception("Failed to refresh the scores")
+
+    def query(self, command, top=None):
+        with self.lock:
+            if command == "scores":
+                data = self.scores
+            elif command == "stat":
+                data = self.portfolio.stat.reindex(self.scores.index)
+            else:
+                raise ValueError(f"Unknown command {command}")
+        return data.head(top) if top else data
+
+    def serve(self, host=DAEMON_HOST, port=DAEMON_PORT):
+        watcher = threading.Thread(target=self.watch, daemon=True)
+        watcher.start()
+        Retention().start()
+        with ScoresServer((host, port), ScoresRequestHandler) as server:
+            server.screener_daemon = self
+            logging.info("Serving scores on %s:%d", host, port)
+            try:
+                server.serve_forever()
+            finally:
+                self.stopped.set()
+
+
+class ScoresServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ScoresRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers a single line "<scores|stat> [top]" with a JSON table
+    """
+
+    def handle(self):
+        command, *args = self.rfile.readline().decode().split() or [""]
+        try:
+            data = self.server.screener_daemon.query(command, int(args[0]) if args else None)
+            response = data.to_json(orient="split")
+        except Exception as error:
+            response = json.dumps({"error": str(error)})
+        self.wfile.write(response.encode())
+
+
+def query(command="scores", top=None, host=DAEMON_HOST, port=DAEMON_PORT):
+    """
+    Ask a running daemon for the current scores or statistics
+    """
+    with socket.create_connection((host, port)) as connection:
+        connection.sendall(f"{command} {top or ''}\n".encode())
+        connection.shutdown(socket.SHUT_WR)
+        response = json.loads(connection.makefile("rb").read().decode())
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return pd.DataFrame(response["data"], index=response["index"], columns=response["columns"])
@@ -5,6 +5,7 @@ from prisma.interfaces.interface import (
     YFinanceHistoryInterface,
     FmpCountryInterface,
 )
+from prisma.interfaces.offline import OfflineProvider
 
 __all__ = [
     "RapidApiStatisticsInterface",
@@ -12,4 +13,5 @@ __all__ = [
     "YahooFinanceHistoryInterface",
     "YFinanceHistoryInterface",
     "FmpCountryInterface",
+    "OfflineProvider",
 ]
@@ -1,13 +1,390 @@
 import os
+import json
+import atexit
+import hashlib
+import zlib
+from collections import OrderedDict
 from datetime import date
 import pickle
+import numpy as np
+import pandas as pd
 import glob
+import sqlite3
+import time
+import threading
 import logging
+from contextlib import contextmanager, suppress
 
-from prisma.constants import CACHE_DIR
+try:
+    import fcntl
+except ImportError:  # leases are not available on Windows
+    fcntl = None
+
+from prisma.constants import (
+    PROJECT_DIR,
+    CACHE_DIR,
+    CACHE_DB,
+    CACHE_BACKEND,
+    COLUMNAR_CACHE_DIR,
+    SQLITE_ACCESS_BUFFER_SIZE,
+    CACHE_QUARANTINE_DIR,
+    CACHE_LOCK_DIR,
+    CACHE_LEASE_SLOTS,
+    CACHE_LEASE_TIMEOUT,
+    CACHE_LEASE_POLL,
+    SQLITE_BUSY_TIMEOUT,
+    MEMORY_CACHE_MAX_ENTRIES,
+    MEMORY_CACHE_MAX_BYTES,
+    PARSED_CACHE_DB,
+    PARSED_CACHE_SCHEMA,
+    PARSED_CACHE_SOURCES,
+)
+from prisma.utils.profiling import profiler
+
+# dates of record keys, so that a name never matches a longer one, such as the name of its failure records
+DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+
+# errors of unpickling truncated or otherwise damaged payloads
+CORRUPT_PAYLOAD_ERRORS = (pickle.UnpicklingError, EOFError, ValueError, IndexError)
+
+
+class CacheRecordError(Exception):
+    """
+    A cached record could not be read: it was removed meanwhile, or it was corrupt and got quarantined
+    """
+
+
+@contextmanager
+def atomic_open(filename):
+    """
+    Open a temporary file next to the target, which replaces the target once it is written completely,
+    so that readers of other processes see either the previous file or the new one
+    """
+    temporary = f"{filename}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, "wb") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+class Lease:
+    """
+    Cross-process lock of a cache key, so that only one process fetches it while the others wait for
+    its record. Locks are held with flock, which the system releases if the holding process dies.
+    """
+
+    def __init__(self, name, directory=CACHE_LOCK_DIR, timeout=CACHE_LEASE_TIMEOUT):
+        # keys share a fixed number of lock files, a collision only makes a fetch wait longer
+        slot = zlib.crc32(name.encode()) % CACHE_LEASE_SLOTS
+        self.name = name
+        self.filename = os.path.join(directory, f"lease-{slot}.lock")
+        self.timeout = timeout
+        self.file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.file = open(self.filename, "a")
+        deadline = time.monotonic() + self.timeout
+        with profiler.timer("lease_wait"):
+            while True:
+                try:
+                    fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return self
+                except BlockingIOError:
+                    if time.monotonic() > deadline:
+                        logging.warning(
+                            "Lease of %s is held for over %d s, going on without it", self.name, self.timeout
+                        )
+                        self.release()
+                        return self
+                    time.sleep(CACHE_LEASE_POLL)
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        if self.file is not None:
+            # closing the file releases its lock
+            self.file.close()
+            self.file = None
+
+
+class PickleDirectoryBackend:
+    """
+    Stores every record as a separate pickle file in a directory
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def get_key(self, name, date):
+        return os.path.join(self.directory, f"{name}-{date}.pkl")
+
+    def split_key(self, key):
+        # dates have a fixed YYYY-MM-DD format, while names may contain dashes
+        full_name = os.path.basename(key)[: -len(".pkl")]
+        return full_name[:-11], full_name[-10:]
+
+    def exists(self, key):
+        return os.path.isfile(key)
+
+    def latest(self, name):
+        files = glob.glob(self.get_key(glob.escape(name), DATE_GLOB))
+        if files:
+            return sorted(files)[-1]  # take the latest
+        return None
+
+    def keys(self):
+        return glob.glob(os.path.join(self.directory, "*.pkl"))
+
+    def entries(self):
+        """
+        Return (key, name, date, size in bytes, last access time) of every record
+        """
+        entries = []
+        for key in self.keys():
+            try:
+                stat = os.stat(key)
+            except FileNotFoundError:
+                continue
+            entries.append((key, *self.split_key(key), stat.st_size, stat.st_atime))
+        return entries
+
+    def touch(self, key):
+        # access times are set explicitly, as file systems are often mounted with relatime or noatime
+        try:
+            os.utime(key, (time.time(), os.stat(key).st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def read(self, key):
+        with open(key, "rb") as file:
+            return file.read()
+
+    def write(self, key, payload):
+        with atomic_open(key) as file:
+            file.write(payload)
+
+    def remove(self, keys):
+        for key in keys:
+            logging.debug("Removing file %s", key)
+            os.remove(key)
+
+    def vacuum(self):
+        pass  # removed files are returned to the file system right away
+
+    def quarantine(self, key, directory=CACHE_QUARANTINE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            os.replace(key, os.path.join(directory, os.path.basename(key)))
+        except FileNotFoundError:
+            pass  # quarantined by another process
+
+    def clean(self, today):
+        for filename in self.keys():
+            if not str(today) in filename:
+                logging.debug("Removing file %s", filename)
+                os.remove(filename)
+
+
+class SqliteBackend:
+    """
+    Stores all records in a single SQLite database indexed by (name, date)
+    """
+
+    def __init__(self, filename=CACHE_DB):
+        self.filename = filename
+        # a single connection is shared by all threads, so every access goes through the lock
+        self.lock = threading.Lock()
+        # other processes sharing the database may hold its write lock for a while, e.g. while vacuuming
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT
+        )
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "name TEXT NOT NULL, date TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (name, date)"
+                ") WITHOUT ROWID"
+            )
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(records)")]
+            if "accessed" not in columns:
+                self.connection.execute("ALTER TABLE records ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+        # access times are buffered, so that reads do not write to the database
+        self.accessed = {}
+        atexit.register(self.flush_access)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def get_key(self, name, date):
+        return (name, str(date))
+
+    def split_key(self, key):
+        return key
+
+    def exists(self, key):
+        return bool(self.execute("SELECT 1 FROM records WHERE name = ? AND date = ?", key))
+
+    def latest(self, name):
+        rows = self.execute("SELECT date FROM records WHERE name = ? ORDER BY date DESC LIMIT 1", (name,))
+        if rows:
+            return (name, rows[0][0])
+        return None
+
+    def keys(self):
+        return self.execute("SELECT name, date FROM records")
+
+    def entries(self):
+        """
+        Return (key, name, date, size in bytes, last access time) of every record
+        """
+        self.flush_access()
+        rows = self.execute("SELECT name, date, LENGTH(data), accessed FROM records")
+        return [((name, date), name, date, size, accessed) for name, date, size, accessed in rows]
+
+    def touch(self, key):
+        with self.lock:
+            self.accessed[key] = time.time()
+            full = len(self.accessed) >= SQLITE_ACCESS_BUFFER_SIZE
+        if full:
+            self.flush_access()
+
+    def flush_access(self):
+        with self.lock:
+            accessed, self.accessed = self.accessed, {}
+            self.connection.executemany(
+                "UPDATE records SET accessed = ? WHERE name = ? AND date = ?",
+                [(timestamp, *key) for key, timestamp in accessed.items()],
+            )
+
+    def read(self, key):
+        rows = self.execute("SELECT data FROM records WHERE name = ? AND date = ?", key)
+        if not rows:
+            raise KeyError(key)
+        return rows[0][0]
+
+    def write(self, key, payload):
+        self.execute(
+            "INSERT OR REPLACE INTO records (name, date, data, accessed) VALUES (?, ?, ?, ?)",
+            (*key, payload, time.time()),
+        )
+
+    def remove(self, keys):
+        with self.lock:
+            self.connection.executemany("DELETE FROM records WHERE name = ? AND date = ?", list(keys))
+
+    def vacuum(self):
+        # return the freed pages to the file system, which rewrites the whole database
+        with self.lock:
+            self.connection.execute("VACUUM")
+
+    def quarantine(self, key, directory=CACHE_QUARANTINE_DIR):
+        rows = self.execute("SELECT data FROM records WHERE name = ? AND date = ?", key)
+        if rows:
+            os.makedirs(directory, exist_ok=True)
+            with atomic_open(os.path.join(directory, f"{key[0]}-{key[1]}.pkl")) as file:
+                file.write(rows[0][0])
+        self.execute("DELETE FROM records WHERE name = ? AND date = ?", key)
+
+    def clean(self, today):
+        count = self.execute("SELECT COUNT(*) FROM records WHERE date != ?", (str(today),))[0][0]
+        logging.debug("Removing %d records from %s", count, self.filename)
+        self.execute("DELETE FROM records WHERE date != ?", (str(today),))
+
+
+class MemoryCache:
+    """
+    Process-wide LRU of unpickled records, bounded by the number of entries and their pickled size.
+    Records are shared between callers, so they must not be modified in place.
+    """
+
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES, max_bytes=MEMORY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.records = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.records
+
+    def get(self, key):
+        with self.lock:
+            if key in self.records:
+                self.records.move_to_end(key)
+                self.hits += 1
+                return True, self.records[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, data, size):
+        with self.lock:
+            if key in self.records:
+                self.size -= self.records.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.records[key] = (data, size)
+            self.size += size
+            while len(self.records) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.records.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.records),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+memory_cache = MemoryCache()
+
+cache_backends = {
+    "pickle": PickleDirectoryBackend,
+    "sqlite": SqliteBackend,
+}
+
+default_backend = None
+default_backend_lock = threading.Lock()
+
+
+def get_default_backend():
+    # the default backend is created once and shared by all caches of the process
+    global default_backend
+    with default_backend_lock:
+        if default_backend is None:
+            assert CACHE_BACKEND in cache_backends, f"Cache backend {CACHE_BACKEND} is not available"
+            default_backend = cache_backends[CACHE_BACKEND]()
+        return default_backend
 
 
 class Cache:
+    def __init__(self, backend=None, memory=memory_cache):
+        self.backend = backend or get_default_backend()
+        self.memory = memory
+
     def get_short_name(self, query, data_type):
         symbol = query["symbol"]
         region = query["region"]
@@ -19,30 +396,243 @@ class Cache:
 
     def get_filename(self, query, data_type):
         today = date.today()
-        full_name = self.get_full_name(query, data_type, today)
-        filename = os.path.join(CACHE_DIR, full_name)
-        return filename
+        return self.backend.get_key(self.get_short_name(query, data_type), today)
 
     def get_older_filename(self, query, data_type):
-        full_name = self.get_full_name(query, data_type, "*")
-        filename = os.path.join(CACHE_DIR, full_name)
-        files = glob.glob(filename)
+        return self.backend.latest(self.get_short_name(query, data_type))
+
+    def has_response(self, filename):
+        return (self.backend, filename) in self.memory or self.backend.exists(filename)
+
+    def cache_response(self, data, filename):
+        payload = pickle.dumps(data)
+        self.backend.write(filename, payload)
+        self.memory.put((self.backend, filename), data, len(payload))
+        return len(payload)
+
+    def load_cahced_response(self, filename):
+        found, data = self.memory.get((self.backend, filename))
+        if found:
+            return data
+        # memory hits never touch the backend, so access times are those of the reads from it
+        self.backend.touch(filename)
+        with profiler.timer("cache_read"):
+            try:
+                payload = self.backend.read(filename)
+            except (FileNotFoundError, KeyError):
+                # removed by the retention of another process since the lookup
+                raise CacheRecordError(f"Record {filename} was removed")
+        with profiler.timer("unpickle"):
+            try:
+                data = pickle.loads(payload)
+            except CORRUPT_PAYLOAD_ERRORS as error:
+                self.quarantine(filename, error)
+        self.memory.put((self.backend, filename), data, len(payload))
+        return data
+
+    def quarantine(self, filename, error):
+        logging.warning("Quarantining the corrupt record %s: %s", filename, error)
+        profiler.count("cache_corrupt")
+        self.backend.quarantine(filename)
+        raise CacheRecordError(f"Record {filename} is corrupt: {error}")
+
+    def clean(self):
+        self.backend.clean(date.today())
+        self.memory.clear()
+
+    def migrate(self, source=None):
+        """
+        Copy all records of another backend (by default, the pickle directory) into this cache
+        """
+        source = source or PickleDirectoryBackend()
+        if type(source) is type(self.backend):
+            return 0
+        count = 0
+        for source_key in source.keys():
+            key = self.backend.get_key(*source.split_key(source_key))
+            if not self.backend.exists(key):
+                self.backend.write(key, source.read(source_key))
+                count += 1
+        logging.info("Migrated %d cache records", count)
+        return count
+
+
+class ColumnarCache:
+    """
+    Stores close price histories as memory-mapped NumPy arrays of (date, close) rows with a JSON sidecar
+    holding the requested date range. Records are {"start", "end", "data"} with data being a close series.
+    Implements the lookup part of the Cache interface, so it can replace the cache of a history interface.
+    """
+
+    DTYPE = np.dtype([("date", "datetime64[D]"), ("close", "f8")])
+
+    def __init__(self, directory=COLUMNAR_CACHE_DIR):
+        self.directory = directory
+
+    def get_short_name(self, query, data_type):
+        symbol = query["symbol"]
+        region = query["region"]
+        return f"{region}-{symbol}-{data_type}"
+
+    def get_filename(self, query, data_type):
+        return os.path.join(self.directory, f"{self.get_short_name(query, data_type)}-{date.today()}.npy")
+
+    def get_older_filename(self, query, data_type):
+        name = glob.escape(self.get_short_name(query, data_type))
+        files = glob.glob(os.path.join(self.directory, f"{name}-{DATE_GLOB}.npy"))
         if files:
             return sorted(files)[-1]  # take the latest
         return None
 
-    def cache_response(self, data, filename):
-        with open(filename, "wb") as file:
-            pickle.dump(data, file)
+    def get_sidecar(self, filename):
+        return filename[: -len(".npy")] + ".json"
+
+    def has_response(self, filename):
+        return os.path.isfile(filename)
+
+    def split_key(self, key):
+        full_name = os.path.basename(key)[: -len(".npy")]
+        return full_name[:-11], full_name[-10:]
+
+    def entries(self):
+        """
+        Return (key, name, date, size in bytes, last access time) of every record
+        """
+        entries = []
+        for key in glob.glob(os.path.join(self.directory, "*.npy")):
+            try:
+                stat = os.stat(key)
+                size = stat.st_size + os.path.getsize(self.get_sidecar(key))
+            except FileNotFoundError:
+                continue
+            entries.append((key, *self.split_key(key), size, stat.st_atime))
+        return entries
+
+    def touch(self, key):
+        try:
+            os.utime(key, (time.time(), os.stat(key).st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, keys):
+        for key in keys:
+            logging.debug("Removing file %s", key)
+            self.remove_record(key)
+
+    def remove_record(self, filename):
+        # records may be partly gone, e.g. after an interrupted write or a removal by another process
+        for path in (filename, self.get_sidecar(filename)):
+            with suppress(FileNotFoundError):
+                os.remove(path)
+
+    def vacuum(self):
+        pass  # removed files are returned to the file system right away
+
+    def cache_response(self, record, filename):
+        os.makedirs(self.directory, exist_ok=True)
+        close = record["data"]
+        array = np.empty(len(close), dtype=self.DTYPE)
+        array["date"] = close.index.values.astype("datetime64[D]")
+        array["close"] = close.to_numpy(dtype=float)
+        with atomic_open(self.get_sidecar(filename)) as file:
+            file.write(json.dumps({"start": str(record["start"]), "end": str(record["end"])}).encode())
+        # the array is written last, as its presence marks the record as complete
+        with atomic_open(filename) as file:
+            np.save(file, array)
+        return array.nbytes
 
     def load_cahced_response(self, filename):
-        with open(filename, "rb") as file:
-            return pickle.load(file)
+        self.touch(filename)
+        with profiler.timer("columnar_read"):
+            try:
+                with open(self.get_sidecar(filename)) as file:
+                    sidecar = json.load(file)
+                array = np.load(filename, mmap_mode="r")
+            except FileNotFoundError:
+                raise CacheRecordError(f"Record {filename} was removed")
+            except (ValueError, EOFError, OSError) as error:
+                self.quarantine(filename, error)
+            # close prices are a view of the mapped file, only the dates are converted
+            data = pd.Series(array["close"], index=pd.DatetimeIndex(array["date"]), name="Close", copy=False)
+            return {
+                "start": date.fromisoformat(sidecar["start"]),
+                "end": date.fromisoformat(sidecar["end"]),
+                "data": data,
+            }
+
+    def quarantine(self, filename, error, directory=CACHE_QUARANTINE_DIR):
+        logging.warning("Quarantining the corrupt record %s: %s", filename, error)
+        profiler.count("cache_corrupt")
+        os.makedirs(directory, exist_ok=True)
+        for path in (filename, self.get_sidecar(filename)):
+            try:
+                os.replace(path, os.path.join(directory, os.path.basename(path)))
+            except FileNotFoundError:
+                pass
+        raise CacheRecordError(f"Record {filename} is corrupt: {error}")
 
     def clean(self):
-        files = glob.glob(os.path.join(CACHE_DIR, "*.pkl"))
-        today = date.today()
-        for filename in files:
-            if not str(today) in filename:
+        today = str(date.today())
+        for filename in glob.glob(os.path.join(self.directory, "*.npy")):
+            if not today in filename:
                 logging.debug("Removing file %s", filename)
-                os.remove(filename)
+                self.remove_record(filename)
+
+
+def get_schema_version(sources=PARSED_CACHE_SOURCES):
+    # any change of the code producing parsed records makes them invalid
+    digest = hashlib.sha1(str(PARSED_CACHE_SCHEMA).encode())
+    for source in sources:
+        with open(os.path.join(PROJECT_DIR, source), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class ParsedCache:
+    """
+    Finished per-asset records, stored in a single SQLite table, so that all of them are read at once.
+    Records of other schema versions are never read and are dropped on the next write.
+    """
+
+    def __init__(self, filename=PARSED_CACHE_DB, schema=None):
+        self.filename = filename
+        self.schema = schema or get_schema_version()
+        self.lock = threading.Lock()
+        # batch runs, jobs and the daemon may write the same database at once
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT
+        )
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS parsed ("
+                "key TEXT NOT NULL PRIMARY KEY, schema TEXT NOT NULL, data BLOB NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def read(self, keys):
+        keys = set(keys)
+        with self.lock, profiler.timer("parsed_read"):
+            rows = self.connection.execute("SELECT key, data FROM parsed WHERE schema = ?", (self.schema,)).fetchall()
+        return {key: pickle.loads(data) for key, data in rows if key in keys}
+
+    def write(self, records):
+        if not records:
+            return
+        rows = [(key, self.schema, pickle.dumps(record)) for key, record in records.items()]
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM parsed WHERE schema != ?", (self.schema,))
+            self.connection.executemany("INSERT OR REPLACE INTO parsed (key, schema, data) VALUES (?, ?, ?)", rows)
+            self.connection.execute("COMMIT")
+
+
+default_parsed_cache = None
+
+
+def get_default_parsed_cache():
+    global default_parsed_cache
+    with default_backend_lock:
+        if default_parsed_cache is None:
+            default_parsed_cache = ParsedCache()
+        return default_parsed_cache
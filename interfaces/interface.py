@@ -1,46 +1,196 @@
-import os
-import requests
-import json
+import pandas as pd
 from functools import partial
-import yfinance
-from yahoofinance import HistoricalPrices
-from urllib.request import urlopen
+from concurrent.futures import Future
+from datetime import date, timedelta
 from collections import OrderedDict
+import threading
 import logging
 
-from prisma.interfaces.cache import Cache
+from prisma.interfaces.cache import Cache, ColumnarCache, CacheRecordError, Lease
 from prisma.interfaces.wallet import Wallet
-from prisma.utils import convert_countries_to_codes, percent_to_float, none_if_zero, read_dict
-from prisma.constants import WALLET_FILE, RAPIDAPI_SECTORS_MAP
+from prisma.interfaces.transport import get_transport, ResponseError
+from prisma.utils import convert_countries_to_codes, percent_to_float, read_dict
+from prisma.utils.profiling import profiler
+from prisma.constants import (
+    WALLET_FILE,
+    RAPIDAPI_SECTORS_MAP,
+    PROVIDER_CONCURRENCY,
+    DEFAULT_PROVIDER_CONCURRENCY,
+    NEGATIVE_CACHE_TTL_DAYS,
+    HISTORY_CHUNK_SIZE,
+)
 
 
 class Interface:
-    def __init__(self, name, allow_outdated=False, **kwargs):
+    # one semaphore per provider, shared by all instances and threads
+    limits = {}
+    limits_lock = threading.Lock()
+    # futures of the requests being fetched right now, by (name, symbol, region)
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+
+    def __init__(self, name, allow_outdated=False, wallet=None, cache=None, request=None, **kwargs):
         super().__init__(**kwargs)
         self.name = name
         self.allow_outdated = allow_outdated
-        self.wallet = Wallet(WALLET_FILE)
-        self.cache = Cache()
+        self.wallet = wallet or Wallet(WALLET_FILE)
+        self.cache = cache or Cache()
+        # failure records are kept in the general cache, even if responses are stored elsewhere
+        self.failure_cache = self.cache
+        if request is not None:
+            # a stand-in with the same signature as the request method, e.g. an offline provider
+            self.request = request
+
+    def get_limit(self):
+        with Interface.limits_lock:
+            if self.name not in Interface.limits:
+                concurrency = PROVIDER_CONCURRENCY.get(self.name, DEFAULT_PROVIDER_CONCURRENCY)
+                Interface.limits[self.name] = threading.BoundedSemaphore(concurrency)
+            return Interface.limits[self.name]
 
-    def get_response(self, name, symbol, region, request_fn):
+    def get_response(self, name, symbol, region, request_fn, covers=None):
+        """
+        Return the response of a cached record or of request_fn, where covers tells whether a cached
+        response answers the request, e.g. whether a history reaches back far enough
+        """
+        start = profiler.start()
         query = {"symbol": symbol, "region": region}
         cache_filename = self.cache.get_filename(query, name)
-        if os.path.isfile(cache_filename):
+        if self.cache.has_response(cache_filename):
             # if fresh record is found, then use it
             logging.debug("Reading the up-to-date record %s", cache_filename)
-            return self.cache.load_cahced_response(cache_filename)
+            found, data = self.read_record(self.cache, cache_filename, covers)
+            if found:
+                profiler.stop(start, "get_response", provider=name, source="fresh")
+                return data
         elif self.allow_outdated:
             # else try to search the older record if wanted
             older_cache_filename = self.cache.get_older_filename(query, name)
             if older_cache_filename:
                 logging.debug("Reading the outdated record %s", older_cache_filename)
-                return self.cache.load_cahced_response(older_cache_filename)
-        # else ask server for a response
-        logging.debug("Requesting %s info about %s %s asset", name, symbol, region)
-        data = request_fn(query)
-        self.cache.cache_response(data, cache_filename)
+                found, data = self.read_record(self.cache, older_cache_filename)
+                if found:
+                    profiler.stop(start, "get_response", provider=name, source="outdated")
+                    return data
+        # else ask server for a response, unless the asset is known to fail
+        failure = self.read_failure(query, name)
+        if failure:
+            profiler.stop(start, "get_response", provider=name, source="failure")
+            return self.use_failure(failure, name, query)
+        try:
+            fetch_fn = partial(self.fetch, name, query, request_fn, cache_filename, covers)
+            return self.coalesce((name, symbol, region), fetch_fn)
+        finally:
+            profiler.stop(start, "get_response", provider=name, source="network")
+
+    def read_record(self, cache, filename, covers=None):
+        """
+        Return (found, data) of a cached record, where unreadable records and records
+        that do not cover the request count as missing
+        """
+        try:
+            data = cache.load_cahced_response(filename)
+        except CacheRecordError as error:
+            logging.debug("Ignoring the cached record: %s", error)
+            return False, None
+        if covers is not None and not covers(data):
+            logging.debug("The cached record %s does not cover the request", filename)
+            return False, None
+        return True, data
+
+    def use_failure(self, failure, name, query):
+        if failure["error"]:
+            raise ResponseError(
+                f"{name} is known to fail for {query['symbol']} since {failure['date']}: {failure['error']}"
+            )
+        logging.debug("Using the known empty %s response for %s %s asset", name, query["symbol"], query["region"])
+        return failure["data"]
+
+    def get_record_key(self, name, symbol, region):
+        """
+        Return the key of the cached record get_response would read, or None if it would ask the server
+        """
+        query = {"symbol": symbol, "region": region}
+        cache_filename = self.cache.get_filename(query, name)
+        if self.cache.has_response(cache_filename):
+            return cache_filename
+        if self.allow_outdated:
+            older_cache_filename = self.cache.get_older_filename(query, name)
+            if older_cache_filename:
+                return older_cache_filename
+        if self.read_failure(query, name):
+            return self.failure_cache.get_older_filename(query, f"{name}-failure")
+        return None
+
+    def coalesce(self, key, fetch_fn):
+        # concurrent callers of the same key wait for the result of the first one
+        with Interface.in_flight_lock:
+            future = Interface.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Interface.in_flight[key] = Future()
+        if not leader:
+            logging.debug("Waiting for the ongoing request of %s", key)
+            return future.result()
+        try:
+            future.set_result(fetch_fn())
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            with Interface.in_flight_lock:
+                del Interface.in_flight[key]
+        return future.result()
+
+    def fetch(self, name, query, request_fn, cache_filename, covers=None):
+        # processes sharing the cache fetch a key one at a time, the others then read its record
+        with Lease(f"{query['region']}-{query['symbol']}-{name}"):
+            if self.cache.has_response(cache_filename):
+                # stored by a request that finished after our cache lookup, possibly in another process
+                found, data = self.read_record(self.cache, cache_filename, covers)
+                if found:
+                    return data
+            failure = self.read_failure(query, name)
+            if failure:
+                return self.use_failure(failure, name, query)
+            return self.request_and_store(name, query, request_fn, cache_filename)
+
+    def request_and_store(self, name, query, request_fn, cache_filename):
+        logging.debug("Requesting %s info about %s %s asset", name, query["symbol"], query["region"])
+        profiler.count("provider_calls", provider=name)
+        try:
+            with self.get_limit():
+                data = request_fn(query)
+        except Exception as error:
+            profiler.count("provider_errors", provider=name)
+            if isinstance(error, ResponseError) and not error.transient:
+                self.store_failure(query, name, error=str(error))
+            raise
+        if self.is_empty(data):
+            self.store_failure(query, name, data=data)
+            return data
+        size = self.cache.cache_response(data, cache_filename)
+        profiler.count("provider_bytes", size, provider=name)
         return data
 
+    def is_empty(self, data):
+        if data is None:
+            return True
+        if isinstance(data, (list, dict)):
+            return not data
+        return getattr(data, "empty", False)
+
+    def read_failure(self, query, name):
+        failure_filename = self.failure_cache.get_older_filename(query, f"{name}-failure")
+        if failure_filename:
+            found, failure = self.read_record(self.failure_cache, failure_filename)
+            if found and date.today() - failure["date"] < timedelta(days=NEGATIVE_CACHE_TTL_DAYS):
+                return failure
+        return None
+
+    def store_failure(self, query, name, error=None, data=None):
+        failure = {"date": date.today(), "error": error, "data": data}
+        self.failure_cache.cache_response(failure, self.failure_cache.get_filename(query, f"{name}-failure"))
+
 
 class RapidApiInterface(Interface):
     def __init__(self, **kwargs):
@@ -49,10 +199,14 @@ class RapidApiInterface(Interface):
             "x-rapidapi-key": self.wallet.read_key("rapidapi"),
             "x-rapidapi-host": "apidojo-yahoo-finance-v1.p.rapidapi.com",
         }
+        self.transport = get_transport("rapidapi")
+
+    def validate(self, data):
+        # quota and authorization errors come as {"message": ...}
+        return isinstance(data, dict) and "message" not in data
 
     def request(self, url, query):
-        response = requests.request("GET", url, headers=self.headers, params=query)
-        return json.loads(response.text)
+        return self.transport.get(url, headers=self.headers, params=query, validate=self.validate)
 
 
 class RapidApiStatisticsInterface(RapidApiInterface):
@@ -111,6 +265,8 @@ class YahooFinanceHistoryInterface(Interface):
         super().__init__(name="yahoofinance_history", **kwargs)
 
     def request(self, start_date, end_date, query):
+        from yahoofinance import HistoricalPrices
+
         req = HistoricalPrices(query["symbol"], start_date=start_date, end_date=end_date)
         return req.to_dfs()
 
@@ -125,22 +281,180 @@ class YahooFinanceHistoryInterface(Interface):
 
 
 class YFinanceHistoryInterface(Interface):
-    def __init__(self, **kwargs):
+    def __init__(self, history_cache=None, request_many=None, **kwargs):
         """
-        Alternative package that works
+        Alternative package that works. Only close prices are kept, in a columnar cache.
         """
         super().__init__(name="yfinance_history", **kwargs)
+        self.cache = history_cache or ColumnarCache()
+        if request_many is not None:
+            # a stand-in with the same signature as request_many, e.g. an offline provider
+            self.request_many = request_many
 
     def request(self, start_date, end_date, query):
+        # yfinance takes a third of the startup time, while cached runs never call it
+        import yfinance
+
         return yfinance.download(query["symbol"], start=start_date, end=end_date, progress=False)
 
+    def request_many(self, start_date, end_date, symbols):
+        """
+        Download several symbols in one threaded call, returning columns of (price, symbol)
+        """
+        import yfinance
+
+        return yfinance.download(
+            symbols, start=start_date, end=end_date, group_by="column", threads=True, progress=False
+        )
+
+    def get_close(self, data):
+        if "Close" not in data:
+            # failed downloads may come without any columns
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([]), name="Close")
+        close = data["Close"]
+        if isinstance(close, pd.DataFrame):
+            # newer yfinance versions label columns by (price, ticker) even for a single ticker
+            close = close.iloc[:, 0]
+        return close.rename("Close")
+
+    def get_cached_start(self, query):
+        """
+        Return the latest cached record, if it covers the requested start, or None
+        """
+        older_cache_filename = self.cache.get_older_filename(query, self.name)
+        found, record = self.read_record(self.cache, older_cache_filename) if older_cache_filename else (False, None)
+        if found:
+            cached_start, _, cached_data = self.unpack(record)
+            if cached_start is not None and not cached_data.empty:
+                return cached_start, cached_data
+        return None, None
+
+    def merge(self, cached_data, tail, start_date, end_date):
+        # the last cached day is requested again, because its close price could be an intraday one
+        tail_start = cached_data.index[-1]
+        tail = tail[tail.index >= tail_start] if not tail.empty else tail
+        if tail.empty:
+            # the cached record must not lose its last day, it is requested again on the next pull
+            raise ResponseError(f"{self.name} returned no history since {tail_start.date()}", transient=True)
+        data = pd.concat([cached_data[cached_data.index < tail_start], tail])
+        data = data[data.index >= pd.Timestamp(start_date)]
+        return {"start": start_date, "end": end_date, "data": data}
+
+    def request_history(self, start_date, end_date, query):
+        """
+        Download only the days missing from the latest cached record, if it covers the requested start
+        """
+        cached_start, cached_data = self.get_cached_start(query)
+        if cached_start is not None and cached_start <= start_date:
+            tail_start = cached_data.index[-1].date()
+            logging.debug("Requesting %s history of %s since %s", self.name, query["symbol"], tail_start)
+            tail = self.get_close(self.request(tail_start, end_date, query))
+            return self.merge(cached_data, tail, start_date, end_date)
+        data = self.request(start_date, end_date, query)
+        if data.empty:
+            # yfinance reports network errors and throttling by returning nothing, which must not be cached
+            raise ResponseError(f"{self.name} returned no history for {query['symbol']}", transient=True)
+        return {"start": start_date, "end": end_date, "data": self.get_close(data)}
+
+    def pull_many(self, symbols, region, start_date, end_date, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Warm the cache with the histories of all symbols that have no up-to-date record,
+        downloading them in chunks instead of one by one. Symbols that fail are left to single pulls.
+        """
+        # one process warms the cache at a time, the others then find its records and download the rest
+        with Lease(f"{region}-{self.name}-bulk"):
+            return self.store_many(symbols, region, start_date, end_date, chunk_size)
+
+    def store_many(self, symbols, region, start_date, end_date, chunk_size):
+        pending = []
+        for symbol in dict.fromkeys(symbols):
+            query = {"symbol": symbol, "region": region}
+            if self.cache.has_response(self.cache.get_filename(query, self.name)):
+                continue
+            if self.allow_outdated and self.cache.get_older_filename(query, self.name):
+                continue
+            if self.read_failure(query, self.name):
+                continue
+            cached_start, cached_data = self.get_cached_start(query)
+            if cached_start is None or cached_start > start_date:
+                cached_data = None
+            pending.append((query, cached_data))
+
+        # symbols with a usable record only need the days since their last cached one,
+        # so a chunk holds symbols needing the same days, and one uncached symbol never extends the others
+        groups = {}
+        for query, cached_data in pending:
+            required_start = start_date if cached_data is None else cached_data.index[-1].date()
+            groups.setdefault(required_start, []).append((query, cached_data))
+        chunks = [
+            (chunk_start, group[i : i + chunk_size])
+            for chunk_start, group in sorted(groups.items())
+            for i in range(0, len(group), chunk_size)
+        ]
+
+        stored = 0
+        for chunk_start, chunk in chunks:
+            chunk_symbols = [query["symbol"] for query, _ in chunk]
+            logging.debug("Requesting %s history of %d symbols since %s", self.name, len(chunk), chunk_start)
+            profiler.count("provider_calls", provider=self.name)
+            try:
+                with self.get_limit():
+                    data = self.request_many(chunk_start, end_date, chunk_symbols)
+            except Exception:
+                profiler.count("provider_errors", provider=self.name)
+                logging.exception("Failed to request %s history of %d symbols", self.name, len(chunk))
+                continue
+            if data.empty or "Close" not in data:
+                continue
+            close = data["Close"]
+            for query, cached_data in chunk:
+                if query["symbol"] not in close:
+                    continue
+                # the columns share the dates of all symbols, so the days of other exchanges are empty
+                symbol_close = close[query["symbol"]].dropna().rename("Close")
+                if symbol_close.empty:
+                    continue
+                if cached_data is None:
+                    symbol_close = symbol_close[symbol_close.index >= pd.Timestamp(start_date)]
+                    record = {"start": start_date, "end": end_date, "data": symbol_close}
+                else:
+                    try:
+                        record = self.merge(cached_data, symbol_close, start_date, end_date)
+                    except ResponseError:
+                        continue
+                size = self.cache.cache_response(record, self.cache.get_filename(query, self.name))
+                profiler.count("provider_bytes", size, provider=self.name)
+                stored += 1
+        logging.info("Stored %s history of %d out of %d symbols", self.name, stored, len(pending))
+        return stored
+
+    def unpack(self, record):
+        """
+        Return the date range covered by a cached record together with its close prices
+        """
+        if isinstance(record, dict):
+            start, end, data = record["start"], record["end"], record["data"]
+        elif record.empty:
+            # older records are bare data frames, so their range can only be read from the index
+            return None, None, record
+        else:
+            start, end, data = record.index[0].date(), record.index[-1].date(), record
+        if isinstance(data, pd.DataFrame):
+            data = self.get_close(data)
+        return start, end, data
+
+    def covers(self, start_date, record):
+        # a record of today can still start too late, e.g. a 5-year one for a longer backtest
+        cached_start, _, _ = self.unpack(record)
+        return cached_start is not None and cached_start <= start_date
+
     def send_request(self, symbol, region, start_date, end_date):
-        request_fn = partial(self.request, start_date, end_date)
-        return self.get_response(self.name, symbol, region, request_fn=request_fn)
+        request_fn = partial(self.request_history, start_date, end_date)
+        return self.get_response(self.name, symbol, region, request_fn, covers=partial(self.covers, start_date))
 
     def pull(self, symbol, region, start_date, end_date):
         response = self.send_request(symbol, "US", start_date, end_date)
-        close_price = response["Close"]
+        _, _, close_price = self.unpack(response)
         return close_price
 
 
@@ -149,13 +463,15 @@ class FmpCountryInterface(Interface):
         super().__init__(name="fmp", **kwargs)
         self.key = self.wallet.read_key("financialmodelingprep")
         self.url = "https://financialmodelingprep.com/api/v3/etf-country-weightings"
+        self.transport = get_transport("fmp")
+
+    def validate(self, data):
+        # errors come as {"Error Message": ...}
+        return isinstance(data, list)
 
     def request(self, query):
         symbol = query["symbol"]
-        full_url = f"{self.url}/{symbol}?apikey={self.key}"
-        response = urlopen(full_url)
-        data = response.read().decode("utf-8")
-        return json.loads(data)
+        return self.transport.get(f"{self.url}/{symbol}", params={"apikey": self.key}, validate=self.validate)
 
     def pull(self, symbol, region):
         """
@@ -0,0 +1,142 @@
+import time
+import zlib
+import random
+import threading
+import numpy as np
+import pandas as pd
+
+from prisma.interfaces.interface import RapidApiStatisticsInterface, YFinanceHistoryInterface, FmpCountryInterface
+from prisma.interfaces.wallet import Wallet
+from prisma.constants import RAPIDAPI_SECTORS_MAP
+
+OFFLINE_COUNTRIES = [
+    "United States",
+    "China",
+    "Japan",
+    "United Kingdom",
+    "Germany",
+    "France",
+    "India",
+    "Taiwan",
+    "Korea",
+    "Hong Kong",
+    "Brazil",
+    "Netherlands",
+    "Switzerland",
+    "Viet Nam",
+    "Thailand",
+    "Indonesia",
+]
+
+
+class OfflineProviderError(ConnectionError):
+    pass
+
+
+class OfflineProvider:
+    """
+    Local stand-in for RapidAPI, Yahoo and FMP that serves synthetic, but realistic payloads.
+    Payloads are deterministic per symbol, while latency and error rate are configurable.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def get_rng(self, query):
+        return random.Random(zlib.crc32(query["symbol"].encode()) + self.seed)
+
+    def respond(self):
+        with self.lock:
+            self.calls += 1
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise OfflineProviderError("Synthetic provider error")
+
+    def statistics(self, url, query):
+        self.respond()
+        rng = self.get_rng(query)
+        price = rng.uniform(10, 400)
+        sectors = rng.sample(list(RAPIDAPI_SECTORS_MAP), rng.randint(1, 6))
+        weights = [rng.random() for _ in sectors]
+        return {
+            "quoteType": {
+                "shortName": f"{query['symbol']} ETF",
+                "longName": f"Synthetic {query['symbol']} Exchange Traded Fund",
+            },
+            "topHoldings": {
+                "equityHoldings": {
+                    "priceToEarnings": {"raw": rng.uniform(5, 40)},
+                    "priceToSales": {"raw": rng.uniform(0.5, 5)},
+                },
+                "sectorWeightings": [
+                    {sector: {"raw": weight / sum(weights)}} for sector, weight in zip(sectors, weights)
+                ],
+            },
+            "defaultKeyStatistics": {"yield": {"raw": rng.uniform(0, 0.06)}},
+            "price": {
+                "averageDailyVolume3Month": {"raw": rng.randint(10**4, 10**8)},
+                "regularMarketPrice": {"raw": price},
+            },
+            "fundProfile": {"feesExpensesInvestment": {"annualReportExpenseRatio": {"raw": rng.uniform(0.0003, 0.01)}}},
+            "summaryDetail": {
+                "fiftyDayAverage": {"raw": price * rng.uniform(0.9, 1.1)},
+                "twoHundredDayAverage": {"raw": price * rng.uniform(0.8, 1.2)},
+            },
+        }
+
+    def history(self, start_date, end_date, query):
+        self.respond()
+        return self.generate_history(start_date, end_date, query)
+
+    def histories(self, start_date, end_date, symbols):
+        # a single round trip for all symbols, with columns of (price, symbol) as yfinance returns them
+        self.respond()
+        data = {symbol: self.generate_history(start_date, end_date, {"symbol": symbol}) for symbol in symbols}
+        return pd.concat(data, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+    def generate_history(self, start_date, end_date, query):
+        rng = np.random.default_rng(zlib.crc32(query["symbol"].encode()) + self.seed)
+        # the whole walk is generated from a fixed origin, so that overlapping requests agree
+        days = np.arange(np.datetime64("2000-01-01"), np.datetime64(end_date, "D"))
+        days = pd.DatetimeIndex(days[np.is_busday(days)])
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, len(days))))
+        data = pd.DataFrame({"Close": close}, index=days)
+        data["Open"] = data["Adj Close"] = data["Close"]
+        data["High"] = data["Close"] * 1.01
+        data["Low"] = data["Close"] * 0.99
+        data["Volume"] = 10**6
+        return data[data.index >= pd.Timestamp(start_date)]
+
+    def countries(self, query):
+        self.respond()
+        rng = self.get_rng(query)
+        names = rng.sample(OFFLINE_COUNTRIES, rng.randint(0, 5))
+        weights = [rng.random() for _ in names]
+        return [
+            {"country": name, "weightPercentage": f"{100 * weight / sum(weights):.2f}%"}
+            for name, weight in zip(names, weights)
+        ]
+
+    def make_interfaces(self, allow_outdated=False, cache=None, history_cache=None):
+        """
+        Interfaces in the order expected by ETF(interfaces=...)
+        """
+        wallet = Wallet(keys={"rapidapi": "offline", "financialmodelingprep": "offline"})
+        kwargs = dict(allow_outdated=allow_outdated, wallet=wallet, cache=cache)
+        return (
+            RapidApiStatisticsInterface(request=self.statistics, **kwargs),
+            YFinanceHistoryInterface(
+                request=self.history, request_many=self.histories, history_cache=history_cache, **kwargs
+            ),
+            FmpCountryInterface(request=self.countries, **kwargs),
+        )
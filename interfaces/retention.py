@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import threading
+from datetime import date
+from collections import defaultdict
+
+from prisma.constants import (
+    DEFAULT_CACHE_KEEP_VERSIONS,
+    CACHE_KEEP_VERSIONS,
+    DEFAULT_CACHE_MAX_AGE_DAYS,
+    CACHE_MAX_AGE_DAYS,
+    CACHE_MAX_BYTES,
+    CACHE_COMPACT_INTERVAL_HOURS,
+    CACHE_COMPACT_STAMP,
+)
+from prisma.interfaces.cache import ColumnarCache, get_default_backend
+
+
+class Retention:
+    """
+    Bounds the records of cache stores (backends or the columnar cache) by:
+    - the number of versions kept per name, i.e. per (region, symbol, data type),
+    - the maximum age per data type, except for the latest version of every name,
+    - the total size, evicting the least recently accessed records first.
+    """
+
+    def __init__(self, stores=None, keep_versions=None, max_age_days=None, max_bytes=CACHE_MAX_BYTES):
+        self.stores = stores or [get_default_backend(), ColumnarCache()]
+        self.keep_versions = CACHE_KEEP_VERSIONS if keep_versions is None else keep_versions
+        self.max_age_days = CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        self.max_bytes = max_bytes
+
+    def get_setting(self, settings, name, default):
+        # names end with the data type, and failure records with "-failure"
+        matches = [data_type for data_type in settings if name.endswith(f"-{data_type}")]
+        if not matches:
+            return default
+        return settings[max(matches, key=len)]
+
+    def select(self, entries, today):
+        """
+        Return {reason: entries to remove} for entries of (key, name, date, size, last access time, store)
+        """
+        removed = defaultdict(list)
+        kept = []
+        versions = defaultdict(list)
+        for entry in entries:
+            versions[(entry[5], entry[1])].append(entry)
+        for (_, name), records in versions.items():
+            keep = self.get_setting(self.keep_versions, name, DEFAULT_CACHE_KEEP_VERSIONS)
+            max_age = self.get_setting(self.max_age_days, name, DEFAULT_CACHE_MAX_AGE_DAYS)
+            records.sort(key=lambda entry: entry[2], reverse=True)  # the latest first
+            for i, entry in enumerate(records):
+                if i == 0:
+                    # the latest record is what --allow-outdated falls back to, however old it is
+                    kept.append(entry)
+                elif (today - date.fromisoformat(entry[2])).days > max_age:
+                    removed["age"].append(entry)
+                elif i >= keep:
+                    removed["versions"].append(entry)
+                else:
+                    kept.append(entry)
+
+        total = sum(entry[3] for entry in kept)
+        if total > self.max_bytes:
+            for entry in sorted(kept, key=lambda entry: entry[4]):  # the least recently accessed first
+                removed["size"].append(entry)
+                total -= entry[3]
+                if total <= self.max_bytes:
+                    break
+        return removed
+
+    def run(self, today=None):
+        """
+        Remove the records violating the policy and return the number of files and bytes reclaimed
+        """
+        today = today or date.today()
+        selected = self.select([(*entry, store) for store in self.stores for entry in store.entries()], today)
+
+        report = {"files": 0, "bytes": 0, "reasons": {}}
+        removed_keys = defaultdict(list)
+        for reason, reason_entries in selected.items():
+            for entry in reason_entries:
+                removed_keys[entry[5]].append(entry[0])
+            size = sum(entry[3] for entry in reason_entries)
+            report["reasons"][reason] = {"files": len(reason_entries), "bytes": size}
+            report["files"] += len(reason_entries)
+            report["bytes"] += size
+        for store, keys in removed_keys.items():
+            store.remove(keys)
+            store.vacuum()
+        logging.info(
+            "Cache compaction removed %d records, %.1f MB (%s)",
+            report["files"],
+            report["bytes"] / 1024**2,
+            ", ".join(f"{reason}: {item['files']}" for reason, item in report["reasons"].items()) or "nothing to do",
+        )
+        return report
+
+    def is_due(self, stamp=CACHE_COMPACT_STAMP, interval_hours=CACHE_COMPACT_INTERVAL_HOURS):
+        try:
+            return time.time() - os.path.getmtime(stamp) > 3600 * interval_hours
+        except FileNotFoundError:
+            return True
+
+    def run_if_due(self, stamp=CACHE_COMPACT_STAMP, interval_hours=CACHE_COMPACT_INTERVAL_HOURS):
+        if not self.is_due(stamp, interval_hours):
+            return None
+        report = self.run()
+        with open(stamp, "w"):
+            pass
+        return report
+
+    def start(self, stamp=CACHE_COMPACT_STAMP, interval_hours=CACHE_COMPACT_INTERVAL_HOURS):
+        """
+        Compact the cache in a background thread, whenever the interval since the last compaction has passed
+        """
+
+        def loop():
+            while True:
+                try:
+                    self.run_if_due(stamp, interval_hours)
+                except Exception:
+                    logging.exception("Failed to compact the cache")
+                time.sleep(60)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,142 @@
+import time
+import random
+import threading
+import logging
+
+from prisma.constants import (
+    PROVIDER_RATE_LIMITS,
+    DEFAULT_PROVIDER_RATE_LIMIT,
+    PROVIDER_CONCURRENCY,
+    DEFAULT_PROVIDER_CONCURRENCY,
+    TRANSPORT_INTERFACES,
+    HTTP_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_BACKOFF,
+    HTTP_MAX_BACKOFF,
+)
+from prisma.utils.profiling import profiler
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ResponseError(Exception):
+    def __init__(self, message, transient=False):
+        super().__init__(message)
+        # transient errors (e.g. throttling) are worth retrying on the next run
+        self.transient = transient
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Transport:
+    """
+    Keep-alive HTTP session of a single provider with rate limiting, retries and response validation
+    """
+
+    def __init__(self, name, rate, burst, pool_size, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.bucket = TokenBucket(rate, burst)
+        self.pool_size = pool_size
+        self.session = None
+        self.session_lock = threading.Lock()
+
+    def get_session(self):
+        # requests is imported on the first request, so that runs served from the cache do not load it
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                self.session.mount("https://", adapter)
+                self.session.mount("http://", adapter)
+            return self.session
+
+    def get_backoff(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_MAX_BACKOFF)
+        # exponential backoff with full jitter
+        return random.uniform(0, min(HTTP_BACKOFF * 2**attempt, HTTP_MAX_BACKOFF))
+
+    def get(self, url, headers=None, params=None, validate=None):
+        """
+        Return the decoded JSON response, or raise ResponseError if it cannot be obtained or is not valid
+        """
+        import requests
+
+        session = self.get_session()
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            retry_after = None
+            profiler.count("http_requests", transport=self.name)
+            try:
+                with profiler.timer("http_request", transport=self.name):
+                    response = session.get(url, headers=headers, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                reason = repr(error)
+            else:
+                profiler.count("http_bytes", len(response.content), transport=self.name)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    if not response.ok:
+                        # only a missing symbol is a lasting failure, while e.g. authorization can be fixed
+                        raise ResponseError(
+                            f"{self.name} responded with {response.status_code}: {response.text}",
+                            transient=response.status_code != 404,
+                        )
+                    try:
+                        data = response.json()
+                    except ValueError:
+                        raise ResponseError(f"{self.name} responded with invalid JSON: {response.text}", transient=True)
+                    if validate and not validate(data):
+                        # error payloads are about quotas and keys rather than the symbol
+                        raise ResponseError(
+                            f"{self.name} responded with unexpected data: {response.text}", transient=True
+                        )
+                    return data
+                reason = f"status {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+            profiler.count("http_retries", transport=self.name)
+            if attempt < self.retries:
+                backoff = self.get_backoff(attempt, retry_after)
+                logging.debug("Request to %s failed (%s), retrying in %.1f s", self.name, reason, backoff)
+                time.sleep(backoff)
+        raise ResponseError(f"{self.name} request failed after {self.retries + 1} attempts ({reason})", transient=True)
+
+
+transports = {}
+transports_lock = threading.Lock()
+
+
+def get_transport(name):
+    # transports are shared by all interfaces of a provider, so they share the connections and the quota
+    with transports_lock:
+        if name not in transports:
+            rate, burst = PROVIDER_RATE_LIMITS.get(name, DEFAULT_PROVIDER_RATE_LIMIT)
+            interfaces = TRANSPORT_INTERFACES.get(name, [name])
+            pool_size = sum(
+                PROVIDER_CONCURRENCY.get(interface, DEFAULT_PROVIDER_CONCURRENCY) for interface in interfaces
+            )
+            transports[name] = Transport(name, rate, burst, pool_size)
+        return transports[name]
@@ -4,10 +4,12 @@ import json
 
 
 class Wallet:
-    def __init__(self, filename):
-        with open(filename, 'r') as file:
-            wallet_data = file.read()
-        self.keys = json.loads(wallet_data)
+    def __init__(self, filename=None, keys=None):
+        self.keys = dict(keys or {})
+        if filename:
+            with open(filename, 'r') as file:
+                wallet_data = file.read()
+            self.keys.update(json.loads(wallet_data))
 
     def read_key(self, name):
         if name in self.keys:
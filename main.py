@@ -1,18 +1,20 @@
+import sys
+import glob
 import argparse
-from ruamel.yaml import YAML
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
-from tabulate import tabulate
 import logging
 
 from prisma.assets import ETF
-from prisma.utils import find_name
-from prisma.interfaces.cache import Cache
+from prisma.utils import country_resolver, exposure_matrix, top_categories
+from prisma.interfaces.cache import Cache, ColumnarCache, get_default_parsed_cache
+from prisma.interfaces.retention import Retention
 from prisma.screener import Screener
-from prisma.constants import HEADER_FORMAT
-
-logging.basicConfig(level=logging.DEBUG)
-
+from prisma.utils.profiling import profiler
+from prisma.utils.output import OUTPUT_FORMATS, format_columns, render, page, write_table
+from prisma.constants import DAEMON_PORT, BACKTEST_HORIZON, TUNING_TOP, TUNING_OBJECTIVE
 
 # Useful information
 # https://www.etfbreakdown.com/
@@ -24,84 +26,366 @@ logging.basicConfig(level=logging.DEBUG)
 
 
 class Portfolio:
-    def __init__(self, settings_file, assets_file, allow_outdated):
+    def __init__(
+        self, settings_file, assets_file, allow_outdated, jobs=1, interfaces=None, inputs=None, parsed_cache=None
+    ):
         self.settings = self.read_yaml(settings_file)
         assets_config = self.read_yaml(assets_file)
-        assets = self.reload_and_update(assets_config, allow_outdated)
+        assets = self.reload_and_update(
+            assets_config, allow_outdated, jobs, interfaces=interfaces, inputs=inputs, parsed_cache=parsed_cache
+        )
         assert assets, "Assets were not found"
         self.format_and_store(assets)
 
-    def read_yaml(self, filename):
+    @staticmethod
+    def read_yaml(filename):
+        from ruamel.yaml import YAML
+
         path = Path(filename)
         yaml = YAML(typ="safe")
         return yaml.load(path)
 
-    def reload_and_update(self, asset_config, allow_outdated):
-        assets = []
+    @classmethod
+    def from_assets(cls, settings, assets):
+        """
+        Portfolio view of already loaded assets
+        """
+        portfolio = cls.__new__(cls)
+        portfolio.settings = settings
+        portfolio.format_and_store(assets)
+        return portfolio
+
+    def reload_and_update(self, asset_config, allow_outdated, jobs=1, **options):
+        assets = self.load_assets(self.parse_assets(asset_config), allow_outdated, jobs, **options)
+        return [asset for asset in assets if asset is not None]
+
+    @staticmethod
+    def parse_assets(asset_config):
+        """
+        Return (asset constructor, symbol, keyword arguments) of every configured asset
+        """
+        requests = []
         asset_classes = {"ETF": ETF}
         for asset_class, asset_constructor in asset_classes.items():
             config = asset_config.get(asset_class)
             if config:
                 for asset in config:
                     if isinstance(asset, str):
-                        assets.append(asset_constructor(asset, allow_outdated))
+                        requests.append((asset_constructor, asset, {}))
                     elif isinstance(asset, dict):
                         for name, kwargs in asset.items():
-                            assets.append(asset_constructor(name, allow_outdated, **kwargs))
+                            requests.append((asset_constructor, name, kwargs or {}))
+        return requests
+
+    @classmethod
+    def load_assets(cls, requests, allow_outdated, jobs=1, parsed_cache=None, **options):
+        """
+        Return the assets in the order of requests, with None for the assets that failed to load.
+        Assets with a valid parsed record are built from it, the others are loaded and their records stored.
+        The default parsed cache is only used with the default interfaces, pass False to disable it.
+        """
+        if parsed_cache is None and options.get("interfaces") is None:
+            parsed_cache = get_default_parsed_cache()
+        keys = [cls.get_asset_key(*request) for request in requests]
+        assets = cls.read_parsed(requests, keys, allow_outdated, parsed_cache, **options) if parsed_cache else {}
+        missing = [i for i in range(len(requests)) if i not in assets]
+        profiler.count("parsed_hits", len(assets))
+        profiler.count("parsed_misses", len(missing))
+
+        loaded = cls.load_requests([requests[i] for i in missing], allow_outdated, jobs, **options)
+        assets.update(zip(missing, loaded))
+        if parsed_cache:
+            parsed_cache.write({keys[i]: assets[i].to_record() for i in missing if assets[i] is not None})
+        return [assets[i] for i in range(len(requests))]
+
+    @staticmethod
+    def get_asset_key(constructor, name, kwargs):
+        # the same symbol with different options (e.g. user-defined countries) is a different asset
+        return json.dumps([constructor.__name__, name, kwargs], sort_keys=True, default=str)
+
+    @staticmethod
+    def read_parsed(requests, keys, allow_outdated, parsed_cache, interfaces=None, inputs=None, **options):
+        """
+        Return {request index: asset} of the requests whose parsed records hold all the required fields
+        """
+        with profiler.timer("read_parsed"):
+            records = parsed_cache.read(keys)
+            interfaces = interfaces or ETF.make_interfaces(allow_outdated)
+            # prices are not stored in records, they are loaded lazily if needed
+            fields = set(ETF.get_fields(inputs)) & set(ETF.RECORD_FIELDS)
+            assets = {}
+            for i, ((constructor, name, kwargs), key) in enumerate(zip(requests, keys)):
+                if constructor is ETF and key in records:
+                    asset = ETF.from_record(name, allow_outdated, records[key], interfaces=interfaces, **kwargs)
+                    if fields <= set(asset.loaded):
+                        assets[i] = asset
+            return assets
+
+    @classmethod
+    def load_requests(cls, requests, allow_outdated, jobs=1, **options):
+        if "price_change" in ETF.get_fields(options.get("inputs")):
+            cls.warm_histories(requests, allow_outdated, options.get("interfaces"))
+        if jobs > 1:
+            # assets are loaded by one pool, while their provider requests go to another one,
+            # so that an asset waiting for its requests never blocks the requests themselves
+            fetch_pool = ThreadPoolExecutor(max_workers=3 * jobs)
+            with fetch_pool, ThreadPoolExecutor(max_workers=jobs) as asset_pool:
+                futures = [
+                    asset_pool.submit(
+                        cls.load_asset, constructor, name, allow_outdated, kwargs, executor=fetch_pool, **options
+                    )
+                    for constructor, name, kwargs in requests
+                ]
+                assets = [future.result() for future in futures]
+        else:
+            assets = [
+                cls.load_asset(constructor, name, allow_outdated, kwargs, **options)
+                for constructor, name, kwargs in requests
+            ]
         return assets
 
+    @staticmethod
+    def warm_histories(requests, allow_outdated, interfaces=None):
+        # one bulk download instead of a request per asset, the assets then read the cache
+        symbols = [name for constructor, name, _ in requests if constructor is ETF]
+        if len(symbols) > 1:
+            _, ihistory, _ = interfaces or ETF.make_interfaces(allow_outdated)
+            ihistory.pull_many(symbols, "US", *ETF.get_history_span())
+
+    @staticmethod
+    def load_asset(asset_constructor, name, allow_outdated, kwargs, **options):
+        try:
+            return asset_constructor(name, allow_outdated, **options, **kwargs)
+        except Exception:
+            logging.exception("Failed to load asset %s, skipping it", name)
+            return None
+
     def format_and_store(self, assets):
         self.countries = {}
         self.sectors = {}
         stat_data = []
         for asset in assets:
             stat_data.append(asset.stat)
-            self.countries[asset.symbol] = asset.countries
             self.sectors[asset.symbol] = asset.sectors
+            # countries are only loaded when they are needed
+            if "countries" in asset.loaded:
+                self.countries[asset.symbol] = asset.countries
         self.stat = pd.DataFrame(stat_data).set_index("Symbol")
 
-    def display(self, by=None):
-        stat = self.stat.copy()
+        # symbols x categories weights, used by the rules and for displaying the largest exposures
+        self.sector_matrix = exposure_matrix(self.sectors, self.stat.index)
+        self.country_matrix = exposure_matrix(self.countries, self.stat.index)
+        position = self.stat.columns.get_loc("200MA") + 1
+        self.stat.insert(position, "Sectors", top_categories(self.sector_matrix).to_numpy())
+        if self.countries:
+            self.stat.insert(position + 1, "Countries", top_categories(self.country_matrix).to_numpy())
+
+    def display(self, by=None, top=None):
+        with profiler.timer("display"):
+            stat = self.stat.sort_values(by=by) if by else self.stat
+            page(render(format_columns(stat.head(top) if top else stat)))
 
-        if by:
-            stat = stat.sort_values(by=by)
+    def scores_table(self, scores):
+        """
+        Scores joined with the statistics of the assets, in the order of the scores
+        """
+        # some rules are named after the statistic they score, e.g. TER
+        return scores.join(self.stat.drop(columns="Name"), rsuffix=" (stat)")
 
-        headers_new_name = {}
-        for header in list(stat):
-            if header in HEADER_FORMAT:
-                if "data" in HEADER_FORMAT[header]:
-                    stat[header] = stat[header].apply(HEADER_FORMAT[header]["data"])
-                if "header" in HEADER_FORMAT[header]:
-                    headers_new_name[header] = HEADER_FORMAT[header]["header"](header)
-        stat.rename(columns=headers_new_name, inplace=True)
 
-        table = tabulate(stat, headers="keys", tablefmt="psql", numalign="right", stralign="right")
-        print(table)
+def show(portfolio, asset_scores, top=None):
+    portfolio.stat = portfolio.stat.reindex(asset_scores.index)
+    portfolio.display(top=top)
+    page(render(asset_scores.head(top) if top else asset_scores))
+
+
+def report_profile(profile_format, filename=None):
+    if profile_format == "json":
+        report = json.dumps(profiler.to_json(), indent=2)
+    elif profile_format == "prometheus":
+        report = profiler.to_prometheus()
+    else:
+        report = profiler.summary()
+    if filename:
+        Path(filename).write_text(report)
+    else:
+        print(report)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Prisma is a software tool that helps you to disintegrate and analyze stocks on a market."
     )
-    parser.add_argument("assets", help="A protfolio file with assets to open")
+    parser.add_argument(
+        "assets",
+        nargs="*",
+        help="Protfolio files (or glob patterns) with assets to open, optional for cache maintenance commands",
+    )
     parser.add_argument(
         "-o", "--allow-outdated", action="store_true", default=False, help="Allow using outdated asset records"
     )
     parser.add_argument("-c", "--clean-cache", action="store_true", default=False, help="Remove all outdated records")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        default=False,
+        help="Apply the cache retention policy now (it is also applied automatically once a day)",
+    )
+    parser.add_argument(
+        "--migrate-cache",
+        action="store_true",
+        default=False,
+        help="Copy records of the old pickle cache directory into the configured cache backend",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Number of assets to load concurrently (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        default=False,
+        help="Keep running, re-score on changes of the settings or assets file and serve the scores",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="results",
+        help="Directory for the scores of every portfolio when screening several files (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--backtest",
+        type=int,
+        metavar="YEARS",
+        help="Score the assets on every trading day of the past years with the price-based rules "
+        "and show forward returns per score decile",
+    )
+    parser.add_argument(
+        "--horizon",
+        type=int,
+        default=BACKTEST_HORIZON,
+        help="Trading days of the forward returns of a backtest (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tune-weights",
+        type=int,
+        metavar="CANDIDATES",
+        help="Score the assets once, evaluate this many random weightings of the rules "
+        "and show the ones maximizing the objective",
+    )
+    parser.add_argument(
+        "--objective",
+        default=TUNING_OBJECTIVE,
+        help="Stat column averaged over the best scored assets when tuning weights (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        choices=OUTPUT_FORMATS,
+        default="table",
+        help="Format of the scores: a terminal table or a machine-readable file (default: %(default)s)",
+    )
+    parser.add_argument("--output-file", help="File to write the scores to (default: standard output)")
+    parser.add_argument(
+        "-n", "--top", type=int, help="Show only the top assets, or the number of top assets compared when tuning"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DAEMON_PORT, help="Port to serve the scores on (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=["summary", "json", "prometheus"],
+        help="Time the stages of the run and count provider calls, bytes and errors",
+    )
+    parser.add_argument("--profile-output", help="File to write the profile to (default: standard output)")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Log debug messages")
     args = parser.parse_args()
 
+    # debug messages are emitted for every cache lookup, which costs time with many assets
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    if args.profile:
+        profiler.enable()
+
+    if args.migrate_cache:
+        Cache().migrate()
+
     if args.clean_cache:
         Cache().clean()
+        ColumnarCache().clean()
 
-    portfolio = Portfolio("settings.yaml", args.assets, args.allow_outdated)
+    if args.compact:
+        report = Retention().run()
+        print(f"Reclaimed {report['bytes'] / 1024**2:.1f} MB in {report['files']} records")
 
-    screener = Screener(rules=portfolio.settings["Rules"])
-    asset_scores = screener(portfolio)
+    if not args.assets:
+        if not (args.migrate_cache or args.clean_cache or args.compact):
+            parser.error("the assets file is required")
+        if args.profile:
+            report_profile(args.profile, args.profile_output)
+        sys.exit()
 
-    portfolio.stat = portfolio.stat.reindex(asset_scores.index)
-    # portfolio.stat = portfolio.stat.head(15)
-    # asset_scores = asset_scores.head(15)
-    portfolio.display()
+    batch = len(args.assets) > 1 or glob.has_magic(args.assets[0])
+    if args.serve:
+        from prisma.daemon import ScreenerDaemon
+
+        if batch:
+            parser.error("only a single assets file can be served")
+        daemon = ScreenerDaemon(
+            "settings.yaml",
+            args.assets[0],
+            args.allow_outdated,
+            args.jobs,
+            on_update=show,
+        )
+        daemon.serve(port=args.port)
+    elif args.backtest:
+        from prisma.backtest import Backtest
+
+        if batch:
+            parser.error("only a single assets file can be backtested")
+        backtest = Backtest("settings.yaml", args.assets[0], args.backtest, args.allow_outdated, args.jobs)
+        scores, _, stats = backtest.run(args.horizon)
+        page(render(stats))
+        if args.output_file:
+            # the score panel has a row per date and a column per asset
+            output_format = "csv" if args.output == "table" else args.output
+            write_table(scores.rename_axis("Date"), output_format, args.output_file)
+    elif args.tune_weights:
+        from prisma.tuning import WeightTuner
+
+        if batch:
+            parser.error("weights can only be tuned on a single assets file")
+        tuner = WeightTuner(
+            "settings.yaml", args.assets[0], args.allow_outdated, args.jobs, args.objective, args.top or TUNING_TOP
+        )
+        results, best = tuner.run(args.tune_weights)
+        tables = [("Configured weights", results.head(1)), ("Over all weightings", tuner.describe(results))]
+        tables.append(("Best weightings", best.head(10)))
+        page("\n".join(f"{title}\n{render(table)}" for title, table in tables))
+        if args.output_file:
+            output_format = "csv" if args.output == "table" else args.output
+            write_table(best.rename_axis("Weighting"), output_format, args.output_file)
+    elif batch:
+        from prisma.batch import BatchScreener
+
+        batch_screener = BatchScreener("settings.yaml", args.assets, args.allow_outdated, args.jobs)
+        results = batch_screener.run()
+        country_resolver.save()
+        output_format = "csv" if args.output == "table" else args.output
+        for filename in batch_screener.write(results, args.output_dir, output_format):
+            logging.info("Scores are written to %s", filename)
+    else:
+        # only the inputs of the configured rules are loaded
+        screener = Screener(rules=Portfolio.read_yaml("settings.yaml")["Rules"])
+        portfolio = Portfolio("settings.yaml", args.assets[0], args.allow_outdated, args.jobs, inputs=screener.inputs())
+        country_resolver.save()
+
+        asset_scores = screener(portfolio)
+        if args.output == "table":
+            show(portfolio, asset_scores, args.top)
+        else:
+            table = portfolio.scores_table(asset_scores)
+            write_table(table.head(args.top) if args.top else table, args.output, args.output_file)
+
+    # retention runs after the screen, so that it never removes records being read
+    Retention().run_if_due()
 
-    table = tabulate(asset_scores, headers="keys", tablefmt="psql", numalign="right", stralign="right")
-    print(table)
+    if args.profile:
+        report_profile(args.profile, args.profile_output)
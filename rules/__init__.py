@@ -7,6 +7,7 @@ from prisma.rules.rules import (
     LtgRule,
     StgRule,
 )
+from prisma.rules.formula import FormulaRule
 
 rule_cls = {
     "SectorRule": SectorRule,
@@ -16,6 +17,7 @@ rule_cls = {
     "DeclineRule": DeclineRule,
     "LtgRule": LtgRule,
     "StgRule": StgRule,
+    "FormulaRule": FormulaRule,
 }
 
 __all__ = list(rule_cls.keys())
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import re
+import ast
+import operator
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+from prisma.constants import FORMULA_COLUMNS
+from prisma.rules.rules import Rule
+
+
+def broadcast(value, template):
+    # scalars take the shape of the column or panel they are combined with
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return value
+    if isinstance(template, pd.DataFrame):
+        return pd.DataFrame(value, index=template.index, columns=template.columns, dtype=float)
+    return pd.Series(value, index=template.index, dtype=float)
+
+
+def cross_section(column, reduce):
+    # a column reduces to a scalar, while every date of a panel reduces to its own value
+    if isinstance(column, pd.DataFrame):
+        values = getattr(column, reduce)(axis=1).to_numpy()[:, None]
+        return pd.DataFrame(np.broadcast_to(values, column.shape), index=column.index, columns=column.columns)
+    if isinstance(column, pd.Series):
+        return getattr(column, reduce)()
+    return column
+
+
+def where(condition, x, y):
+    template = next((value for value in (condition, x, y) if isinstance(value, (pd.Series, pd.DataFrame))), None)
+    if template is None:
+        return x if condition else y
+    condition = broadcast(condition, template).fillna(False).astype(bool)
+    return broadcast(x, template).where(condition, broadcast(y, template))
+
+
+def clip(x, lower=None, upper=None):
+    if isinstance(x, (pd.Series, pd.DataFrame)):
+        return x.clip(lower, upper)
+    return np.clip(x, lower, upper)
+
+
+def fillna(x, value):
+    if isinstance(x, (pd.Series, pd.DataFrame)):
+        return x.fillna(value)
+    return value if np.isnan(x) else x
+
+
+def rank(x):
+    # percentile ranks of the assets, per date for panels
+    if isinstance(x, pd.DataFrame):
+        return x.rank(axis=1, pct=True)
+    return x.rank(pct=True)
+
+
+def elementwise_or_cross_section(ufunc, reduce):
+    def function(*args):
+        if len(args) == 1:
+            return cross_section(args[0], reduce)
+        result = args[0]
+        for arg in args[1:]:
+            result = ufunc(result, arg)
+        return result
+
+    return function
+
+
+def logical_not(x):
+    if isinstance(x, (pd.Series, pd.DataFrame)):
+        return ~x.fillna(False).astype(bool)
+    return not x
+
+
+FORMULA_FUNCTIONS = {
+    "where": where,
+    "clip": clip,
+    "fillna": fillna,
+    "rank": rank,
+    # max(x) is the maximum over assets, max(x, y) the elementwise one
+    "max": elementwise_or_cross_section(np.fmax, "max"),
+    "min": elementwise_or_cross_section(np.fmin, "min"),
+    "mean": lambda x: cross_section(x, "mean"),
+    "abs": np.abs,
+    "log": np.log,
+    "sqrt": np.sqrt,
+    "isna": lambda x: x.isna() if isinstance(x, (pd.Series, pd.DataFrame)) else np.isnan(x),
+}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.Mod: operator.mod,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: logical_not,
+    ast.Invert: logical_not,
+}
+
+COMPARISONS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+
+def substitute_columns(formula):
+    """
+    Replace column names, which are not Python identifiers (e.g. P/E or 1M), by placeholders.
+    Return the substituted formula and the columns of the placeholders.
+    """
+    columns = []
+
+    def placeholder(match):
+        column = match.group(1) or match.group(2)
+        if column not in columns:
+            columns.append(column)
+        return f"_column{columns.index(column)}"
+
+    names = "|".join(re.escape(column) for column in sorted(FORMULA_COLUMNS, key=len, reverse=True))
+    pattern = rf"`([^`]+)`|(?<![\w.])({names})(?!\w)"
+    return re.sub(pattern, placeholder, formula), columns
+
+
+def compile_node(node, columns):
+    """
+    Turn a node of the parsed formula into a function of the input columns, allowing only
+    numbers, columns, arithmetic, comparisons, boolean operators and the formula functions
+    """
+    if isinstance(node, ast.Expression):
+        return compile_node(node.body, columns)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float, bool):
+        value = node.value
+        return lambda inputs: value
+    if isinstance(node, ast.Name):
+        assert node.id.startswith("_column"), f"Unknown column {node.id}, quote it with backticks"
+        index = int(node.id[len("_column") :])
+        return lambda inputs: inputs[index]
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        function = BINARY_OPERATORS[type(node.op)]
+        left, right = compile_node(node.left, columns), compile_node(node.right, columns)
+        return lambda inputs: function(left(inputs), right(inputs))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        function = UNARY_OPERATORS[type(node.op)]
+        operand = compile_node(node.operand, columns)
+        return lambda inputs: function(operand(inputs))
+    if isinstance(node, ast.BoolOp):
+        function = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        values = [compile_node(value, columns) for value in node.values]
+
+        def boolean(inputs):
+            result = values[0](inputs)
+            for value in values[1:]:
+                result = function(result, value(inputs))
+            return result
+
+        return boolean
+    if isinstance(node, ast.Compare) and all(type(op) in COMPARISONS for op in node.ops):
+        # chained comparisons, e.g. 0 < P/E < 20, hold if all of their parts hold
+        operands = [compile_node(operand, columns) for operand in [node.left, *node.comparators]]
+        functions = [COMPARISONS[type(op)] for op in node.ops]
+
+        def compare(inputs):
+            values = [operand(inputs) for operand in operands]
+            result = functions[0](values[0], values[1])
+            for i, function in enumerate(functions[1:], start=1):
+                result = result & function(values[i], values[i + 1])
+            return result
+
+        return compare
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        assert node.func.id in FORMULA_FUNCTIONS, f"Function {node.func.id} is not available"
+        function = FORMULA_FUNCTIONS[node.func.id]
+        args = [compile_node(arg, columns) for arg in node.args]
+        return lambda inputs: function(*[arg(inputs) for arg in args])
+    raise AssertionError(f"Formula element {ast.dump(node)} is not allowed")
+
+
+@lru_cache(maxsize=None)
+def compile_formula(formula):
+    """
+    Parse a formula once and return (evaluator of the input columns, input columns)
+    """
+    substituted, columns = substitute_columns(formula)
+    try:
+        tree = ast.parse(substituted, mode="eval")
+    except SyntaxError as error:
+        raise AssertionError(f"Formula {formula} is not valid: {error.msg}")
+    assert columns, f"Formula {formula} does not read any column"
+    return compile_node(tree, columns), columns
+
+
+class FormulaRule(Rule):
+    """
+    Scores an expression over stat columns, evaluated on whole columns at once, e.g.
+    clip(1 - P/E / 20, -1, 1) or where(rank(1Y) > 0.8, 1, 0). Columns missing from FORMULA_COLUMNS
+    are quoted with backticks.
+    """
+
+    def __init__(self, formula, name=None, **kwargs):
+        super().__init__(name=name or formula, **kwargs)
+        self.formula = formula
+        self.inputs = list(compile_formula(formula)[1])
+
+    def process(self, *columns):
+        evaluate, _ = compile_formula(self.formula)
+        score = broadcast(evaluate(columns), columns[0]).astype(float)
+        if isinstance(score, pd.Series):
+            score.name = self.name
+        return score
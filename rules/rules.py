@@ -1,13 +1,42 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 import pandas as pd
 from prisma.utils import convert_countries_to_codes, find_name
 
 
 class Rule:
+    # portfolio inputs read by the rule: stat columns, "sectors" or "countries"
+    inputs = []
+
     def __init__(self, name="", weight=1.0):
         self.name = name
         self.weight = weight
 
+    def read_inputs(self, portfolio):
+        matrices = {"sectors": portfolio.sector_matrix, "countries": portfolio.country_matrix}
+        return [matrices[name] if name in matrices else portfolio.stat[name] for name in self.inputs]
+
+    def zeros_like(self, column):
+        # rules score a column of assets, or a panel of dates x assets in backtests
+        if isinstance(column, pd.DataFrame):
+            return pd.DataFrame(0.0, index=column.index, columns=column.columns)
+        return pd.Series(0.0, index=column.index, name=self.name)
+
+    def score(self, portfolio):
+        """
+        Unweighted scores of the assets of a portfolio
+        """
+        return self.process(*self.read_inputs(portfolio))
+
+    def __call__(self, portfolio):
+        return self.score(portfolio) * self.weight
+
+    def panel(self, inputs):
+        """
+        Score a panel of dates x assets for every input, given as {input: panel}
+        """
+        return self.process(*[inputs[name] for name in self.inputs]) * self.weight
+
 
 class TextBasedRule(Rule):
     def __init__(
@@ -26,43 +55,34 @@ class TextBasedRule(Rule):
         self.fair_decline = fair_decline or []
         self.strong_decline = strong_decline or []
 
-    def evaluate_single(self, data, prediction, multiplier):
-        score = 0
-        for categoty in data:
-            if categoty in prediction:
-                score += data[categoty]
-                # if isinstance(data, dict):
-                #     score += data[categoty]
-                # else:
-                #     score += 1.0 / len(data)
-        return multiplier * score
-
-    def evaluate(self, data):
-        score = 0
-        score += self.evaluate_single(data, self.strong_growing, 1)
-        score += self.evaluate_single(data, self.fair_growing, 0.5)
-        score += self.evaluate_single(data, self.fair_decline, -0.5)
-        score += self.evaluate_single(data, self.strong_decline, -1)
-        return score
-
-    def calculate_scores(self, symbols, data):
-        scores = []
-        for symbol in symbols:
-            score = self.evaluate(data[symbol])
-            scores.append(score)
+    def multipliers(self, categories):
+        # categories listed in several buckets sum up their multipliers
+        vector = np.zeros(len(categories))
+        vector += categories.isin(self.strong_growing) * 1
+        vector += categories.isin(self.fair_growing) * 0.5
+        vector += categories.isin(self.fair_decline) * -0.5
+        vector += categories.isin(self.strong_decline) * -1
+        return vector
+
+    def calculate_scores(self, symbols, matrix):
+        matrix = matrix.reindex(symbols).fillna(0.0)
+        scores = matrix.to_numpy() @ self.multipliers(matrix.columns)
         return pd.Series(scores, name=self.name, index=symbols)
 
 
 class SectorRule(TextBasedRule):
+    inputs = ["sectors"]
+
     def __init__(self, name="Sector", **kwargs):
         super().__init__(name=name, **kwargs)
 
-    def __call__(self, portfolio):
-        symbols = portfolio.stat.index
-        return self.calculate_scores(symbols, portfolio.sectors) * self.weight
+    def score(self, portfolio):
+        return self.calculate_scores(portfolio.stat.index, portfolio.sector_matrix)
 
 
 class CountryRule(TextBasedRule):
+    inputs = ["countries"]
+
     def __init__(self, name="Country", **kwargs):
         super().__init__(name=name, **kwargs)
         self.strong_growing = convert_countries_to_codes(self.strong_growing)
@@ -70,14 +90,17 @@ class CountryRule(TextBasedRule):
         self.fair_decline = convert_countries_to_codes(self.fair_decline)
         self.strong_decline = convert_countries_to_codes(self.strong_decline)
 
-    def __call__(self, portfolio):
-        symbols = portfolio.stat.index
-        return self.calculate_scores(symbols, portfolio.countries) * self.weight
+    def score(self, portfolio):
+        return self.calculate_scores(portfolio.stat.index, portfolio.country_matrix)
 
 
 class PePsRule(Rule):
-    def __init__(self, name="P/E P/S", **kwargs):
+    inputs = ["P/E", "P/S"]
+
+    def __init__(self, name="P/E P/S", pe_threshold=20.0, ps_threshold=2.0, **kwargs):
         super().__init__(name=name, **kwargs)
+        self.pe_threshold = pe_threshold
+        self.ps_threshold = ps_threshold
 
     def process_single(self, x, threshold):
         # x_score = pd.Series(0, index=x.index, name=x.name)
@@ -88,11 +111,8 @@ class PePsRule(Rule):
         return 1 - x / threshold
 
     def process(self, pe, ps):
-        PE_THRESHOLD = 20.0
-        PS_THRESHOLD = 2.0
-
-        pe_score = self.process_single(pe, PE_THRESHOLD)
-        ps_score = self.process_single(ps, PS_THRESHOLD)
+        pe_score = self.process_single(pe, self.pe_threshold)
+        ps_score = self.process_single(ps, self.ps_threshold)
 
         pe_score = pe_score.fillna(ps_score)
         ps_score = ps_score.fillna(pe_score)
@@ -100,87 +120,85 @@ class PePsRule(Rule):
         mean_score.name = self.name
         return mean_score
 
-    def __call__(self, portfolio):
-        pe = portfolio.stat["P/E"]
-        ps = portfolio.stat["P/S"]
-        return self.process(pe, ps) * self.weight
-
 
 class TerRule(Rule):
-    def __init__(self, name="TER", **kwargs):
+    inputs = ["TER"]
+
+    def __init__(self, name="TER", max_ter=0.01, **kwargs):
         super().__init__(name=name, **kwargs)
+        self.max_ter = max_ter
 
     def process(self, column):
-        new_column = pd.Series(0, index=column.index, name=self.name)
+        new_column = pd.Series(0.0, index=column.index, name=self.name)
         # new_column[column < 0.002] = 0.2
         # new_column[(column >= 0.002) & (column < 0.005)] = 0.1
         # new_column[column >= 0.005] = 0.0
         # return new_column
-        idx = column < 0.01
-        new_column[idx] = 0.01 - column[idx]
-        return new_column * 100 * self.weight
-
-    def __call__(self, portfolio):
-        data = portfolio.stat["TER"]
-        return self.process(data)
+        idx = column < self.max_ter
+        new_column[idx] = self.max_ter - column[idx]
+        return new_column * 100
 
 
 class DeclineRule(Rule):
-    def __init__(self, name="Decline score", **kwargs):
+    inputs = ["1M", "3M", "5Y"]
+
+    def __init__(
+        self,
+        name="Decline score",
+        minimum_expected_yearly_growth=0.15,
+        large_rebound_multiplier=1.5,
+        small_rebound_multiplier=2.0,
+        **kwargs,
+    ):
         super().__init__(name=name, **kwargs)
+        self.minimum_expected_yearly_growth = minimum_expected_yearly_growth  # in %
+        self.large_rebound_multiplier = large_rebound_multiplier
+        self.small_rebound_multiplier = small_rebound_multiplier
 
     def process(self, m1, m3, y5):
-        MINIMUM_EXPECTED_YEARLY_GROUTH = 0.15  # in %
-        LARGE_REBOUND_MULTIPLIER = 1.5
-        SMALL_REBOUND_MULTIPLIER = 2.0
+        growth = self.minimum_expected_yearly_growth
 
-        new_column = pd.Series(0, index=m1.index, name=self.name)
+        new_column = self.zeros_like(m1)
 
-        y5_per_month = y5.copy() / 12
-        m3_per_month = m3.copy() / 3
+        y5_per_month = y5 / 12
+        m3_per_month = m3 / 3
 
-        long_term_grouth = y5 > MINIMUM_EXPECTED_YEARLY_GROUTH
+        long_term_grouth = y5 > growth
 
         m1_m3_below_y5 = (y5_per_month > m3_per_month) | (y5_per_month > m1)
-        m1_m3_average = (m3_per_month + m1) / 2
-        m1_m3_average[m1_m3_average < 0] = 0
+        m1_m3_average = ((m3_per_month + m1) / 2).clip(lower=0)
 
         m1_pos_little_m3_neg = (m1 > 0) & (m3 < 0) & (m1 < 0.05)
         m1_pos_much_m3_neg = (m1 > 0) & (m3 < 0) & (m1 < 0.10)
 
         # temporary decline is a good signal for buying
-        new_column[m1_m3_below_y5 & long_term_grouth] = MINIMUM_EXPECTED_YEARLY_GROUTH - m1_m3_average
-        new_column[m1_pos_much_m3_neg & m1_m3_below_y5 & long_term_grouth] = (
-            MINIMUM_EXPECTED_YEARLY_GROUTH * LARGE_REBOUND_MULTIPLIER
+        new_column = new_column.mask(m1_m3_below_y5 & long_term_grouth, growth - m1_m3_average)
+        new_column = new_column.mask(
+            m1_pos_much_m3_neg & m1_m3_below_y5 & long_term_grouth,
+            growth * self.large_rebound_multiplier,
         )
-        new_column[m1_pos_little_m3_neg & m1_m3_below_y5 & long_term_grouth] = (
-            MINIMUM_EXPECTED_YEARLY_GROUTH * SMALL_REBOUND_MULTIPLIER
+        new_column = new_column.mask(
+            m1_pos_little_m3_neg & m1_m3_below_y5 & long_term_grouth,
+            growth * self.small_rebound_multiplier,
         )
-        return new_column / (MINIMUM_EXPECTED_YEARLY_GROUTH * SMALL_REBOUND_MULTIPLIER)
-
-    def __call__(self, portfolio):
-        price_change_1m = portfolio.stat["1M"]
-        price_change_3m = portfolio.stat["3M"]
-        price_change_5y = portfolio.stat["5Y"]
-        return self.process(price_change_1m, price_change_3m, price_change_5y) * self.weight
+        return new_column / (growth * self.small_rebound_multiplier)
 
 
 class LtgRule(Rule):
+    inputs = ["5Y"]
+
     def __init__(self, name="Long-term grouth", **kwargs):
         super().__init__(name=name, **kwargs)
 
     def process(self, y):
+        if isinstance(y, pd.DataFrame):
+            # every date of a panel is normalized by its own maximum
+            return y.div(y.max(axis=1), axis=0)
         return pd.Series(y / y.max(), index=y.index, name=self.name)
 
-    def __call__(self, portfolio):
-        price_change_5y = portfolio.stat["5Y"]
-        return self.process(price_change_5y) * self.weight
-
 
 class StgRule(LtgRule):
+    inputs = ["1Y"]
+
     def __init__(self, name="Short-term grouth", **kwargs):
         super().__init__(name=name, **kwargs)
-
-    def __call__(self, portfolio):
-        price_change_1y = portfolio.stat["1Y"]
-        return self.process(price_change_1y) * self.weight
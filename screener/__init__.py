@@ -1,5 +1,8 @@
 from prisma.screener.screener import Screener
+from prisma.screener.rule_cache import RuleCache, rule_cache
 
 __all__ = [
     "Screener",
+    "RuleCache",
+    "rule_cache",
 ]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+from prisma.constants import RULE_CACHE_MAX_BYTES
+
+
+class RuleCache:
+    """
+    LRU of unweighted rule scores keyed by a fingerprint of the rule parameters and of the exact inputs it reads.
+    Weights are applied on top, so re-weighting a rule does not evaluate it again.
+    Cached scores are shared, so they must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=RULE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.outputs = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def fingerprint(self, rule, portfolio):
+        digest = hashlib.blake2b(digest_size=16)
+        parameters = {name: value for name, value in vars(rule).items() if name != "weight"}
+        parameters = json.dumps(parameters, sort_keys=True, default=str)
+        digest.update(f"{type(rule).__name__}:{parameters}".encode())
+        for data in rule.read_inputs(portfolio):
+            if isinstance(data, pd.DataFrame):
+                digest.update(json.dumps(list(map(str, data.columns))).encode())
+            digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def __call__(self, rule, portfolio):
+        return self.score(rule, portfolio) * rule.weight
+
+    def score(self, rule, portfolio):
+        key = self.fingerprint(rule, portfolio)
+        with self.lock:
+            if key in self.outputs:
+                self.outputs.move_to_end(key)
+                self.hits += 1
+                return self.outputs[key][0]
+            self.misses += 1
+
+        output = rule.score(portfolio)
+        size = int(output.memory_usage(deep=True))
+        with self.lock:
+            if key not in self.outputs and size <= self.max_bytes:
+                self.outputs[key] = (output, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, (_, evicted_size) = self.outputs.popitem(last=False)
+                    self.size -= evicted_size
+                    self.evictions += 1
+        return output
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.outputs),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+rule_cache = RuleCache()
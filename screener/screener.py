@@ -1,26 +1,68 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 from prisma.rules import rule_cls
+from prisma.screener.rule_cache import rule_cache
+from prisma.utils.profiling import profiler
 
 
 class Screener:
-    def __init__(self, rules):
+    def __init__(self, rules, cache=rule_cache):
+        # rules are evaluated through the cache, unless it is None
+        self.cache = cache
         self.rules = []
         for rule in rules:
-            if isinstance(rule, dict):
-                for class_name, kwargs in rule.items():
-                    assert class_name in rule_cls, f"Rule {class_name} is not available"
-                    dynamically_created_rule = rule_cls[class_name](**kwargs)
-                    self.rules.append(dynamically_created_rule)
-            else:
-                assert rule in rule_cls, f"Rule {rule} is not available"
-                dynamically_created_rule = rule_cls[rule]()
-                self.rules.append(dynamically_created_rule)
+            self.rules.extend(self.make_rules(rule))
+
+    @staticmethod
+    def make_rules(rule):
+        """
+        Create rules from a single entry of the settings
+        """
+        if isinstance(rule, dict):
+            rules = []
+            for class_name, kwargs in rule.items():
+                assert class_name in rule_cls, f"Rule {class_name} is not available"
+                dynamically_created_rule = rule_cls[class_name](**(kwargs or {}))
+                rules.append(dynamically_created_rule)
+            return rules
+        assert rule in rule_cls, f"Rule {rule} is not available"
+        dynamically_created_rule = rule_cls[rule]()
+        return [dynamically_created_rule]
+
+    def inputs(self):
+        """
+        Portfolio inputs read by all rules, so that only those have to be loaded
+        """
+        return set().union(*(rule.inputs for rule in self.rules))
+
+    def score(self, rule, portfolio):
+        with profiler.timer("rule", rule=type(rule).__name__):
+            if self.cache is None:
+                return rule.score(portfolio)
+            return self.cache.score(rule, portfolio)
+
+    def evaluate(self, rule, portfolio):
+        return self.score(rule, portfolio) * rule.weight
+
+    def weights(self):
+        return pd.Series([rule.weight for rule in self.rules], index=[rule.name for rule in self.rules], dtype=float)
+
+    def score_matrix(self, portfolio):
+        """
+        Unweighted scores of every rule (assets x rules), so that total scores are score_matrix @ weights
+        """
+        names = [rule.name for rule in self.rules]
+        assert len(set(names)) == len(names), "Rule names must be unique"
+        matrix = pd.concat([self.score(rule, portfolio) for rule in self.rules], axis=1, keys=names)
+        # missing scores count as zero, as in the total score
+        return matrix.reindex(portfolio.stat.index).fillna(0.0)
 
     def __call__(self, portfolio):
+        return self.combine(portfolio, [self.evaluate(rule, portfolio) for rule in self.rules])
+
+    def combine(self, portfolio, rule_scores):
         columns = [portfolio.stat["Name"]]
-        for rule in self.rules:
-            columns.append(rule(portfolio))
+        columns.extend(rule_scores)
 
         scores = pd.concat(columns, axis=1, keys=[col.name for col in columns])
         scores["Total score"] = scores.sum(axis=1, numeric_only=True)
@@ -0,0 +1,32 @@
+import os
+
+from prisma.assets import ETF
+from prisma.backtest import Backtest
+from prisma.interfaces.cache import Cache, ColumnarCache, MemoryCache, PickleDirectoryBackend
+from prisma.interfaces.offline import OfflineProvider
+from prisma.constants import PROJECT_DIR
+
+SETTINGS_FILE = os.path.join(PROJECT_DIR, "settings.yaml")
+
+
+def make_interfaces(provider, tmp_path):
+    cache = Cache(PickleDirectoryBackend(str(tmp_path / "cache")), memory=MemoryCache())
+    return provider.make_interfaces(cache=cache, history_cache=ColumnarCache(str(tmp_path / "history")))
+
+
+def test_backtest_after_screen_reads_the_whole_history(tmp_path):
+    provider = OfflineProvider()
+    interfaces = make_interfaces(provider, tmp_path)
+    symbols = ["AAA", "BBB", "CCC"]
+    # the screen stores today's records of the 5-year span
+    start_date, end_date = ETF.get_history_span()
+    for symbol in symbols:
+        interfaces[1].pull(symbol, "US", start_date, end_date)
+    assets_file = tmp_path / "assets.yml"
+    assets_file.write_text(f"ETF: [{', '.join(symbols)}]\n")
+
+    _, rule_scores, _ = Backtest(SETTINGS_FILE, str(assets_file), years=1, interfaces=interfaces).run()
+
+    assert provider.calls == 2 * len(symbols)
+    for scores in rule_scores.values():
+        assert not scores.isna().any().any()
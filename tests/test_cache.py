@@ -0,0 +1,91 @@
+import os
+import time
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from prisma.interfaces.cache import Cache, ColumnarCache, Lease, MemoryCache, PickleDirectoryBackend, atomic_open, fcntl
+
+
+def test_failure_records_are_not_read_as_responses(tmp_path):
+    cache = Cache(PickleDirectoryBackend(str(tmp_path)), memory=MemoryCache())
+    query = {"symbol": "X", "region": "US"}
+    record = cache.backend.get_key(cache.get_short_name(query, "fmp"), date(2020, 1, 1))
+    cache.cache_response({"US": 1.0}, record)
+    failure = {"date": date.today(), "error": "boom", "data": None}
+    cache.cache_response(failure, cache.get_filename(query, "fmp-failure"))
+
+    assert cache.get_older_filename(query, "fmp") == record
+    assert cache.load_cahced_response(cache.get_older_filename(query, "fmp")) == {"US": 1.0}
+    assert cache.load_cahced_response(cache.get_older_filename(query, "fmp-failure")) == failure
+
+
+def test_columnar_records_without_sidecar_are_removed(tmp_path):
+    cache = ColumnarCache(str(tmp_path))
+    filename = cache.get_filename({"symbol": "X", "region": "US"}, "yfinance_history")
+    close = pd.Series([1.0, 2.0], index=pd.date_range("2026-10-16", periods=2), name="Close")
+    cache.cache_response({"start": date(2026, 10, 16), "end": date(2026, 10, 18), "data": close}, filename)
+    os.remove(cache.get_sidecar(filename))
+
+    cache.remove([filename])
+    assert not os.path.exists(filename)
+
+
+def test_memory_hits_do_not_touch_the_backend(tmp_path):
+    touched = []
+
+    class Backend(PickleDirectoryBackend):
+        def touch(self, key):
+            touched.append(key)
+
+    cache = Cache(Backend(str(tmp_path)), memory=MemoryCache())
+    filename = cache.get_filename({"symbol": "X", "region": "US"}, "fmp")
+    cache.cache_response([], filename)
+    cache.load_cahced_response(filename)
+    assert touched == []
+
+    cache.memory.clear()
+    cache.load_cahced_response(filename)
+    assert touched == [filename]
+
+
+def test_columnar_records_round_trip(tmp_path):
+    cache = ColumnarCache(str(tmp_path))
+    query = {"symbol": "X", "region": "US"}
+    filename = cache.get_filename(query, "yfinance_history")
+    close = pd.Series([1.5, 2.25, 3.0], index=pd.to_datetime(["2026-10-14", "2026-10-15", "2026-10-16"]), name="Close")
+    cache.cache_response({"start": date(2026, 10, 1), "end": date(2026, 10, 18), "data": close}, filename)
+
+    assert cache.has_response(filename) and cache.get_older_filename(query, "yfinance_history") == filename
+    record = cache.load_cahced_response(filename)
+    assert (record["start"], record["end"]) == (date(2026, 10, 1), date(2026, 10, 18))
+    pd.testing.assert_series_equal(record["data"], close, check_index_type=False)
+
+
+@pytest.mark.skipif(fcntl is None, reason="leases need fcntl")
+def test_leases_are_exclusive_until_released_or_timed_out(tmp_path):
+    with Lease("US-X-fmp", directory=str(tmp_path)) as lease:
+        assert lease.file is not None
+        start = time.monotonic()
+        # flock locks of separate open files exclude each other, as those of other processes do
+        with Lease("US-X-fmp", directory=str(tmp_path), timeout=0.2) as waiting:
+            assert waiting.file is None
+        assert time.monotonic() - start >= 0.2
+    assert lease.file is None
+    with Lease("US-X-fmp", directory=str(tmp_path), timeout=0) as lease:
+        assert lease.file is not None
+
+
+def test_atomic_writes_keep_the_previous_file_on_errors(tmp_path):
+    filename = str(tmp_path / "record.pkl")
+    with atomic_open(filename) as file:
+        file.write(b"first")
+    with pytest.raises(RuntimeError):
+        with atomic_open(filename) as file:
+            file.write(b"partial")
+            raise RuntimeError("interrupted")
+
+    with open(filename, "rb") as file:
+        assert file.read() == b"first"
+    assert os.listdir(tmp_path) == ["record.pkl"]
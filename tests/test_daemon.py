@@ -0,0 +1,29 @@
+import os
+from datetime import date
+
+from prisma.constants import PROJECT_DIR
+from prisma.daemon import ScreenerDaemon
+from prisma.interfaces.cache import Cache, ColumnarCache, MemoryCache, PickleDirectoryBackend
+from prisma.interfaces.offline import OfflineProvider
+
+SETTINGS_FILE = os.path.join(PROJECT_DIR, "settings.yaml")
+
+
+def test_assets_are_reloaded_on_a_new_day(tmp_path):
+    cache = Cache(PickleDirectoryBackend(str(tmp_path)), memory=MemoryCache())
+    interfaces = OfflineProvider().make_interfaces(cache=cache, history_cache=ColumnarCache(str(tmp_path / "history")))
+    assets_file = tmp_path / "assets.yml"
+    assets_file.write_text("ETF: [AAA, BBB]\n")
+    updates = []
+    daemon = ScreenerDaemon(
+        SETTINGS_FILE, str(assets_file), interfaces=interfaces, on_update=lambda *update: updates.append(update)
+    )
+    assets = dict(daemon.assets)
+    assert not daemon.refresh()
+
+    daemon.day = date(2000, 1, 1)
+    assert daemon.refresh()
+    assert daemon.day == date.today()
+    assert all(daemon.assets[key] is not asset for key, asset in assets.items())
+    # handlers get their own portfolio, so that the served one is never changed outside the lock
+    assert len(updates) == 2 and all(portfolio is not daemon.portfolio for portfolio, _ in updates[1:])
@@ -0,0 +1,82 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from prisma.assets import ETF
+from prisma.constants import WINDOW_MULTIPLIER
+from prisma.interfaces.offline import OfflineProvider
+from prisma.utils import BatchConvDateSeries, RollingConvDateSeries
+from prisma.utils.filters import Gaussian
+
+
+def make_prices():
+    days = pd.bdate_range("2026-01-01", "2026-06-30")
+    rng = np.random.default_rng(0)
+    prices = pd.DataFrame(100 + rng.normal(0, 1, (len(days), 2)).cumsum(axis=0), index=days, columns=["A", "B"])
+    # B does not trade for two weeks, so windows inside the gap are shifted backwards
+    prices.loc["2026-03-02":"2026-03-13", "B"] = np.nan
+    return prices
+
+
+def reference_filter(price, mean, std):
+    # the filter of ConvDateSeries, applied to a single column
+    gaussian = Gaussian(0, std)
+    half_window = WINDOW_MULTIPLIER * std
+    price = price.dropna()
+    days = np.array([(day.date() - mean).days for day in price.index])
+    for offset in range(8):
+        inside = (days >= -half_window - offset) & (days <= half_window - offset)
+        if inside.any():
+            weights = np.array([gaussian(day) for day in days[inside]])
+            return weights @ price.to_numpy()[inside] / weights.sum()
+    return np.nan
+
+
+@pytest.mark.parametrize("std", [1, 3, 12])
+def test_batch_filter_matches_the_filter_of_every_column(std):
+    prices = make_prices()
+    # a working day, a Sunday and a day in the gap of B
+    means = [date(2026, 2, 4), date(2026, 3, 8), date(2026, 3, 11)]
+    filtered = BatchConvDateSeries()(prices, means, std)
+    expected = [[reference_filter(prices[column], mean, std) for column in prices] for mean in means]
+    np.testing.assert_allclose(filtered, expected, rtol=1e-12)
+
+
+def test_batch_filter_leaves_columns_without_prices_empty():
+    prices = make_prices()
+    prices["C"] = np.nan
+    filtered = BatchConvDateSeries()(prices, [date(2026, 2, 4)], 3)
+    assert np.isnan(filtered[0, 2]) and not np.isnan(filtered[0, :2]).any()
+
+
+@pytest.mark.parametrize("std", [1, 3, 12])
+def test_rolling_filter_matches_the_batch_filter_at_every_day(std):
+    prices = make_prices()
+    days = pd.date_range("2026-02-01", "2026-03-31")
+    rolling = RollingConvDateSeries()(prices, std).reindex(days)
+    causal = RollingConvDateSeries()(prices, std, causal=True).reindex(days)
+
+    batch = BatchConvDateSeries()
+    np.testing.assert_allclose(rolling, batch(prices, days.date, std), rtol=1e-12)
+    # the causal filter of a day only knows the prices until that day
+    expected = [batch(prices[prices.index <= day], [day.date()], std)[0] for day in days]
+    np.testing.assert_allclose(causal, expected, rtol=1e-12)
+
+
+def test_price_panel_matches_the_price_changes_of_every_date():
+    provider = OfflineProvider()
+    prices = pd.concat(
+        {
+            symbol: provider.generate_history(date(2019, 1, 1), date(2026, 6, 30), {"symbol": symbol})["Close"]
+            for symbol in ["A", "B", "C"]
+        },
+        axis=1,
+    )
+    dates = pd.to_datetime(["2025-06-02", "2026-01-04", "2026-06-29"])
+    panel = ETF.filter_price_panel(prices, dates)
+    for day in dates:
+        expected = ETF.filter_prices(prices[prices.index <= day], today=day.date())
+        for horizon, changes in panel.items():
+            np.testing.assert_allclose(changes.loc[day], expected[horizon], rtol=1e-10)
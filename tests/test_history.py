@@ -0,0 +1,134 @@
+import os
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from prisma.interfaces import YFinanceHistoryInterface
+from prisma.interfaces.cache import Cache, ColumnarCache, MemoryCache, PickleDirectoryBackend
+from prisma.interfaces.offline import OfflineProvider
+from prisma.interfaces.transport import ResponseError
+from prisma.interfaces.wallet import Wallet
+
+
+def make_interface():
+    interface = YFinanceHistoryInterface.__new__(YFinanceHistoryInterface)
+    interface.name = "yfinance_history"
+    return interface
+
+
+def test_empty_tail_does_not_shorten_the_cached_history():
+    interface = make_interface()
+    cached = pd.Series([1.0, 2.0, 3.0, 4.0, 5.0], index=pd.date_range("2026-10-12", periods=5))
+    for tail in (interface.get_close(pd.DataFrame()), cached.iloc[:2]):
+        with pytest.raises(ResponseError):
+            interface.merge(cached, tail, date(2026, 10, 1), date(2026, 10, 18))
+
+
+def test_tail_replaces_the_last_cached_day():
+    interface = make_interface()
+    cached = pd.Series([1.0, 2.0, 3.0], index=pd.date_range("2026-10-12", periods=3))
+    tail = pd.Series([3.5, 4.0], index=pd.date_range("2026-10-14", periods=2))
+    record = interface.merge(cached, tail, date(2026, 10, 1), date(2026, 10, 18))
+    assert record["data"].tolist() == [1.0, 2.0, 3.5, 4.0]
+
+
+def test_empty_download_is_not_cached_as_a_failure(tmp_path):
+    cache = Cache(PickleDirectoryBackend(str(tmp_path / "cache")), memory=MemoryCache())
+    interface = YFinanceHistoryInterface(
+        request=lambda start_date, end_date, query: pd.DataFrame(),
+        wallet=Wallet(keys={}),
+        cache=cache,
+        history_cache=ColumnarCache(str(tmp_path / "history")),
+    )
+    with pytest.raises(ResponseError):
+        interface.pull("X", "US", date(2020, 1, 1), date(2026, 10, 18))
+    assert interface.read_failure({"symbol": "X", "region": "US"}, interface.name) is None
+
+
+def test_bulk_download_requests_each_symbol_since_its_last_cached_day(tmp_path):
+    provider = OfflineProvider()
+    starts = []
+
+    def request_many(start_date, end_date, symbols):
+        starts.append((start_date, sorted(symbols)))
+        return provider.histories(start_date, end_date, symbols)
+
+    history_cache = ColumnarCache(str(tmp_path))
+    interface = YFinanceHistoryInterface(
+        request_many=request_many,
+        wallet=Wallet(keys={}),
+        cache=Cache(PickleDirectoryBackend(str(tmp_path)), memory=MemoryCache()),
+        history_cache=history_cache,
+    )
+    start_date, end_date = date(2021, 1, 4), date.today()
+    yesterday = end_date - timedelta(days=1)
+    for symbol in ("AAA", "BBB"):
+        close = interface.get_close(provider.generate_history(start_date, yesterday, {"symbol": symbol}))
+        record = {"start": start_date, "end": yesterday, "data": close}
+        history_cache.cache_response(
+            record, os.path.join(str(tmp_path), f"US-{symbol}-{interface.name}-{yesterday}.npy")
+        )
+
+    assert interface.store_many(["AAA", "BBB", "CCC"], "US", start_date, end_date, chunk_size=10) == 3
+    last_cached_day = close.index[-1].date()
+    assert starts == [(start_date, ["CCC"]), (last_cached_day, ["AAA", "BBB"])]
+    record = history_cache.load_cahced_response(
+        history_cache.get_filename({"symbol": "AAA", "region": "US"}, interface.name)
+    )
+    expected = interface.get_close(provider.generate_history(start_date, end_date, {"symbol": "AAA"}))
+    pd.testing.assert_series_equal(record["data"], expected, check_freq=False)
+
+
+def test_pull_requests_only_the_days_since_the_last_cached_one(tmp_path):
+    provider = OfflineProvider()
+    requests = []
+
+    def request(start_date, end_date, query):
+        requests.append(start_date)
+        return provider.history(start_date, end_date, query)
+
+    history_cache = ColumnarCache(str(tmp_path))
+    interface = YFinanceHistoryInterface(
+        request=request,
+        wallet=Wallet(keys={}),
+        cache=Cache(PickleDirectoryBackend(str(tmp_path)), memory=MemoryCache()),
+        history_cache=history_cache,
+    )
+    start_date, end_date = date(2021, 1, 4), date.today()
+    yesterday = end_date - timedelta(days=1)
+    cached = interface.get_close(provider.generate_history(start_date - timedelta(days=30), yesterday, {"symbol": "X"}))
+    record = {"start": start_date - timedelta(days=30), "end": yesterday, "data": cached}
+    history_cache.cache_response(record, os.path.join(str(tmp_path), f"US-X-{interface.name}-{yesterday}.npy"))
+
+    close = interface.pull("X", "US", start_date, end_date)
+    assert requests == [cached.index[-1].date()]
+    expected = interface.get_close(provider.generate_history(start_date, end_date, {"symbol": "X"}))
+    pd.testing.assert_series_equal(close, expected, check_freq=False)
+    # the record spans the requested dates, so that later pulls of them find it
+    record = history_cache.load_cahced_response(
+        history_cache.get_filename({"symbol": "X", "region": "US"}, interface.name)
+    )
+    assert (record["start"], record["end"]) == (start_date, end_date)
+
+
+def test_pull_many_warms_the_cache_for_single_pulls(tmp_path):
+    provider = OfflineProvider()
+    interface = YFinanceHistoryInterface(
+        request=provider.history,
+        request_many=provider.histories,
+        wallet=Wallet(keys={}),
+        cache=Cache(PickleDirectoryBackend(str(tmp_path)), memory=MemoryCache()),
+        history_cache=ColumnarCache(str(tmp_path)),
+    )
+    symbols = ["AAA", "BBB", "CCC", "DDD", "EEE"]
+    start_date, end_date = date(2021, 1, 4), date.today()
+
+    assert interface.pull_many(symbols, "US", start_date, end_date, chunk_size=2) == len(symbols)
+    assert provider.calls == 3
+    for symbol in symbols:
+        close = interface.pull(symbol, "US", start_date, end_date)
+        assert close.index[0] >= pd.Timestamp(start_date) and not close.isna().any()
+    assert provider.calls == 3
+    # symbols with up-to-date records are not requested again
+    assert interface.pull_many(symbols, "US", start_date, end_date) == 0 and provider.calls == 3
@@ -0,0 +1,27 @@
+from datetime import date
+
+from prisma.interfaces.retention import Retention
+
+
+def make_entries(name, dates, size=1, store="store"):
+    return [(f"{name}-{day}", name, day, size, i, store) for i, day in enumerate(dates)]
+
+
+def test_versions_and_age_keep_the_latest_record():
+    retention = Retention(stores=["store"], keep_versions={"fmp": 2}, max_age_days={"fmp": 30}, max_bytes=100)
+    entries = make_entries("US-X-fmp", ["2026-10-01", "2026-10-10", "2026-10-18"])
+    entries += make_entries("US-Y-fmp", ["2025-01-01", "2025-02-01"])
+    removed = retention.select(entries, date(2026, 10, 18))
+
+    assert [entry[0] for entry in removed["versions"]] == ["US-X-fmp-2026-10-01"]
+    # every record of Y is too old, but its latest one is still the fallback of --allow-outdated
+    assert [entry[0] for entry in removed["age"]] == ["US-Y-fmp-2025-01-01"]
+    assert "size" not in removed
+
+
+def test_size_budget_evicts_the_least_recently_accessed():
+    retention = Retention(stores=["store"], keep_versions={}, max_age_days={}, max_bytes=25)
+    entries = make_entries("US-X-fmp", ["2026-10-16", "2026-10-17", "2026-10-18"], size=10)
+    removed = retention.select(entries, date(2026, 10, 18))
+
+    assert [entry[0] for entry in removed["size"]] == ["US-X-fmp-2026-10-16"]
@@ -0,0 +1,5 @@
+from prisma.tuning.tuning import WeightTuner
+
+__all__ = [
+    "WeightTuner",
+]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import logging
+import numpy as np
+import pandas as pd
+
+from prisma.main import Portfolio
+from prisma.screener import Screener
+from prisma.constants import (
+    TUNING_CANDIDATES,
+    TUNING_SPREAD,
+    TUNING_TOP,
+    TUNING_OBJECTIVE,
+    TUNING_TOP_SHARE,
+    TUNING_CHUNK_CELLS,
+)
+
+
+class WeightTuner:
+    """
+    Evaluates many weightings of the configured rules on rule scores computed once, as the total scores
+    of all weightings are a product of the score matrix (assets x rules) and the weights (rules x weightings)
+    """
+
+    def __init__(
+        self,
+        settings_file,
+        assets_file,
+        allow_outdated=False,
+        jobs=1,
+        objective=TUNING_OBJECTIVE,
+        top=TUNING_TOP,
+        interfaces=None,
+    ):
+        self.screener = Screener(rules=Portfolio.read_yaml(settings_file)["Rules"])
+        # the objective column is loaded even if no rule reads it
+        inputs = self.screener.inputs() | {objective}
+        portfolio = Portfolio(settings_file, assets_file, allow_outdated, jobs, interfaces=interfaces, inputs=inputs)
+        assert objective in portfolio.stat, f"Objective column {objective} is not available"
+        self.matrix = self.screener.score_matrix(portfolio)
+        self.weights = self.screener.weights()
+        self.objective_name = objective
+        self.objective = portfolio.stat[objective].reindex(self.matrix.index).to_numpy(dtype=float)
+        self.top = min(top, len(self.matrix))
+
+    def candidates(self, count=TUNING_CANDIDATES, spread=TUNING_SPREAD, seed=None):
+        """
+        Return the configured weights followed by random ones (weightings x rules)
+        """
+        rng = np.random.default_rng(seed)
+        weights = self.weights.to_numpy()
+        factors = rng.uniform(1 - spread, 1 + spread, (count, len(weights)))
+        return np.vstack([weights, weights * factors])
+
+    def best(self, totals, count):
+        # indices of the best scored assets of every weighting (count x weightings)
+        return np.argpartition(-totals, count - 1, axis=0)[:count]
+
+    def rank(self, totals):
+        # 0 is the best scored asset of every weighting
+        return np.argsort(np.argsort(-totals, axis=0, kind="stable"), axis=0)
+
+    def evaluate(self, candidates, chunk_cells=TUNING_CHUNK_CELLS):
+        """
+        Return rank stability (Spearman correlation with the ranking of the first weighting), overlap of the
+        top assets with it and the objective averaged over the best scored assets of every weighting
+        """
+        scores = self.matrix.to_numpy()
+        size = len(scores)
+        top_share = max(1, int(np.ceil(size * TUNING_TOP_SHARE)))
+        reference = scores @ candidates[0]
+        reference_rank = self.rank(reference[:, None])[:, 0]
+        reference_top = self.best(reference[:, None], self.top)[:, 0]
+
+        chunk_size = max(1, chunk_cells // size)
+        stability, overlap, objective = [], [], []
+        for start in range(0, len(candidates), chunk_size):
+            totals = scores @ candidates[start : start + chunk_size].T
+            # Spearman correlation of rankings without ties
+            squares = ((self.rank(totals) - reference_rank[:, None]) ** 2).sum(axis=0)
+            stability.append(1 - 6 * squares / (size * (size**2 - 1)) if size > 1 else np.ones(totals.shape[1]))
+            overlap.append(np.isin(self.best(totals, self.top), reference_top).sum(axis=0) / self.top)
+            values = self.objective[self.best(totals, top_share)]
+            known = ~np.isnan(values)
+            with np.errstate(invalid="ignore"):
+                objective.append(np.where(known, values, 0).sum(axis=0) / known.sum(axis=0))
+
+        results = pd.DataFrame(candidates, columns=self.weights.index)
+        results["Rank stability"] = np.concatenate(stability)
+        results[f"Top-{self.top} overlap"] = np.concatenate(overlap)
+        results[f"Top {TUNING_TOP_SHARE:.0%} {self.objective_name}"] = np.concatenate(objective)
+        return results
+
+    def run(self, count=TUNING_CANDIDATES, spread=TUNING_SPREAD, seed=None):
+        """
+        Return the results of all weightings, the configured one first, and the weightings sorted by the objective
+        """
+        candidates = self.candidates(count, spread, seed)
+        logging.info("Evaluating %d weightings of %d rules on %d assets", len(candidates), *self.matrix.shape[::-1])
+        results = self.evaluate(candidates)
+        return results, results.sort_values(by=results.columns[-1], ascending=False)
+
+    def describe(self, results):
+        """
+        Distribution of rank stability and top overlap over the weightings
+        """
+        columns = results.columns[-3:-1]
+        return results[columns].describe(percentiles=[0.05, 0.5, 0.95]).drop(index="count")
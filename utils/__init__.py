@@ -1,10 +1,24 @@
-from prisma.utils.filters import ConvDateSeries
-from prisma.utils.utils import convert_countries_to_codes, find_name, percent_to_float, none_if_zero, read_dict
+from prisma.utils.filters import ConvDateSeries, BatchConvDateSeries, RollingConvDateSeries
+from prisma.utils.utils import (
+    country_resolver,
+    convert_countries_to_codes,
+    find_name,
+    exposure_matrix,
+    top_categories,
+    percent_to_float,
+    none_if_zero,
+    read_dict,
+)
 
 __all__ = [
     "ConvDateSeries",
+    "BatchConvDateSeries",
+    "RollingConvDateSeries",
+    "country_resolver",
     "convert_countries_to_codes",
     "find_name",
+    "exposure_matrix",
+    "top_categories",
     "percent_to_float",
     "none_if_zero",
     "read_dict",
@@ -1,4 +1,7 @@
 import math
+from functools import lru_cache
+import numpy as np
+import pandas as pd
 from constants import WINDOW_MULTIPLIER
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
@@ -40,3 +43,129 @@ class ConvDateSeries:
             if norm > 0:
                 return filtered_x / norm
         return float("nan")
+
+
+@lru_cache(maxsize=None)
+def gaussian_kernel(std, half_window, max_offset):
+    # weights for every possible distance (in days) between a window day and the window mean,
+    # from -(half_window + max_offset) to half_window
+    days = np.arange(-(half_window + max_offset), half_window + 1)
+    kernel = np.exp(-(days**2) / (2 * std**2)) / (math.sqrt(2 * math.pi) * std)
+    kernel.flags.writeable = False
+    return kernel
+
+
+def to_days(dates):
+    # convert dates or a date index to integer day numbers
+    if isinstance(dates, pd.Index):
+        return pd.to_datetime(dates).values.astype("datetime64[D]").astype(np.int64)
+    return np.array(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+class BatchConvDateSeries:
+    """
+    Vectorized version of ConvDateSeries, which filters all columns (assets) of a price matrix
+    at several dates in one call. Missing prices (NaN) are treated as non-business days.
+    """
+
+    MAX_OFFSET = 8
+
+    def __call__(self, x, means, std):
+        if isinstance(x, pd.Series):
+            x = x.to_frame()
+        x = x.sort_index()
+        days = to_days(x.index)
+        values = x.to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+
+        half_window = WINDOW_MULTIPLIER * std
+        kernel = gaussian_kernel(std, half_window, self.MAX_OFFSET - 1)
+        kernel_center = half_window + self.MAX_OFFSET - 1
+
+        filtered = np.full((len(means), values.shape[1]), np.nan)
+        for i, mean in enumerate(to_days(means)):
+            pending = np.ones(values.shape[1], dtype=bool)
+            # Shift backwards by offset days if no bussiness days were found in that time frame
+            for offset in range(self.MAX_OFFSET):
+                lo = np.searchsorted(days, mean - half_window - offset, side="left")
+                hi = np.searchsorted(days, mean + half_window - offset, side="right")
+                if lo == hi:
+                    continue
+                weights = kernel[days[lo:hi] - mean + kernel_center]
+                norm = weights @ present[lo:hi]
+                found = pending & (norm > 0)
+                if found.any():
+                    filtered[i, found] = (weights @ values[lo:hi, found]) / norm[found]
+                    pending &= ~found
+                if not pending.any():
+                    break
+        return filtered
+
+
+class RollingConvDateSeries:
+    """
+    Filters all columns (assets) of a price matrix at every calendar day between its first and last date,
+    with the same window shifting as ConvDateSeries. With causal=True days after the filtered one are not used,
+    as it happens when filtering at today's date.
+    """
+
+    MAX_OFFSET = 8
+
+    def accumulate(self, target, source, shift, weight):
+        # target[t] += weight * source[t + shift] for every t with both days on the grid
+        n = len(source)
+        if abs(shift) >= n:
+            return
+        if shift >= 0:
+            target[: n - shift] += weight * source[shift:]
+        else:
+            target[-shift:] += weight * source[: n + shift]
+
+    def __call__(self, x, std, causal=False):
+        if isinstance(x, pd.Series):
+            x = x.to_frame()
+        x = x.sort_index()
+        days = to_days(x.index)
+        grid = np.arange(days[0], days[-1] + 1)
+        raw = x.to_numpy(dtype=float)
+        values = np.zeros((len(grid), raw.shape[1]))
+        present = np.zeros((len(grid), raw.shape[1]))
+        values[days - days[0]] = np.where(np.isnan(raw), 0.0, raw)
+        present[days - days[0]] = ~np.isnan(raw)
+
+        half_window = WINDOW_MULTIPLIER * std
+        kernel = gaussian_kernel(std, half_window, self.MAX_OFFSET - 1)
+        kernel_center = half_window + self.MAX_OFFSET - 1
+        last = 0 if causal else half_window
+
+        norm = np.zeros_like(values)
+        filtered_x = np.zeros_like(values)
+        # days are counted separately, as subtracted weights may leave rounding errors instead of zeros
+        count = np.zeros_like(values)
+        for shift in range(-half_window, last + 1):
+            self.accumulate(filtered_x, values, shift, kernel[shift + kernel_center])
+            self.accumulate(norm, present, shift, kernel[shift + kernel_center])
+            self.accumulate(count, present, shift, 1)
+
+        filtered = np.full(values.shape, np.nan)
+        pending = np.ones(values.shape, dtype=bool)
+        for offset in range(self.MAX_OFFSET):
+            if offset > 0:
+                # shifting the window backwards adds a day at its start and drops one at its end
+                added = -half_window - offset
+                self.accumulate(filtered_x, values, added, kernel[added + kernel_center])
+                self.accumulate(norm, present, added, kernel[added + kernel_center])
+                self.accumulate(count, present, added, 1)
+                dropped = half_window - offset + 1
+                if dropped <= last:
+                    self.accumulate(filtered_x, values, dropped, -kernel[dropped + kernel_center])
+                    self.accumulate(norm, present, dropped, -kernel[dropped + kernel_center])
+                    self.accumulate(count, present, dropped, -1)
+            found = pending & (count > 0.5)
+            filtered[found] = filtered_x[found] / norm[found]
+            pending &= ~found
+            if not pending.any():
+                break
+        index = pd.DatetimeIndex(grid.astype("datetime64[D]"))
+        return pd.DataFrame(filtered, index=index, columns=x.columns)
@@ -0,0 +1,72 @@
+import sys
+import shutil
+import pydoc
+
+from prisma.constants import HEADER_FORMAT, OUTPUT_CHUNK_ROWS
+
+OUTPUT_FORMATS = ["table", "csv", "jsonl", "parquet"]
+
+
+def format_columns(table):
+    """
+    Apply HEADER_FORMAT to the columns of a table, formatting every column at once
+    """
+    columns = {}
+    headers_new_name = {}
+    for header in table.columns:
+        if header in HEADER_FORMAT:
+            if "data" in HEADER_FORMAT[header]:
+                columns[header] = HEADER_FORMAT[header]["data"](table[header])
+            if "header" in HEADER_FORMAT[header]:
+                headers_new_name[header] = HEADER_FORMAT[header]["header"](header)
+    return table.assign(**columns).rename(columns=headers_new_name)
+
+
+def render(table):
+    from tabulate import tabulate
+
+    return tabulate(table, headers="keys", tablefmt="psql", numalign="right", stralign="right")
+
+
+def page(text):
+    # long tables are shown through a pager in a terminal, while pipes get them as they are
+    if sys.stdout.isatty() and text.count("\n") > shutil.get_terminal_size().lines:
+        pydoc.pager(text)
+    else:
+        print(text)
+
+
+def write_table(table, output_format, filename=None, chunk_rows=OUTPUT_CHUNK_ROWS):
+    """
+    Stream the rows of a table as CSV, JSON lines or Parquet to a file or the standard output,
+    a chunk of rows at a time
+    """
+    assert output_format in OUTPUT_FORMATS[1:], f"Output format {output_format} is not supported"
+    table = table.rename_axis(table.index.name or "Symbol").reset_index()
+    chunks = (table.iloc[start : start + chunk_rows] for start in range(0, len(table), chunk_rows))
+
+    if output_format == "parquet":
+        assert filename, "Parquet output needs a file"
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow")
+        schema = pyarrow.Schema.from_pandas(table, preserve_index=False)
+        with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        return
+
+    file = open(filename, "w", newline="") if filename else sys.stdout
+    try:
+        for i, chunk in enumerate(chunks):
+            if output_format == "csv":
+                chunk.to_csv(file, header=i == 0, index=False)
+            else:
+                lines = chunk.to_json(orient="records", lines=True, date_format="iso", double_precision=15)
+                # older pandas versions do not end the last line
+                file.write(lines if lines.endswith("\n") else lines + "\n")
+    finally:
+        if filename:
+            file.close()
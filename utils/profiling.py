@@ -0,0 +1,120 @@
+import re
+import time
+import threading
+from contextlib import nullcontext
+from collections import defaultdict
+
+NULL_TIMER = nullcontext()
+
+
+class Timer:
+    def __init__(self, profiler, name, labels):
+        self.profiler = profiler
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_time(self.name, self.labels, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """
+    Collects timers and counters of a run. While disabled, timers are a shared no-op context manager
+    and counters return right away, so instrumentation costs close to nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = defaultdict(lambda: [0, 0.0, 0.0])  # (name, labels) -> [count, total, max]
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, tuple(sorted(labels.items())))
+
+    def start(self):
+        """
+        Start timing, when the name or labels of the timer are known only at its end
+        """
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, start, name, **labels):
+        if start is not None:
+            self.add_time(name, tuple(sorted(labels.items())), time.perf_counter() - start)
+
+    def add_time(self, name, labels, seconds):
+        with self.lock:
+            timer = self.timers[(name, labels)]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def count(self, name, value=1, **labels):
+        if self.enabled:
+            with self.lock:
+                self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def format_name(self, name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+    def to_json(self):
+        with self.lock:
+            return {
+                "timers": [
+                    {"name": name, "labels": dict(labels), "count": count, "seconds": total, "max_seconds": longest}
+                    for (name, labels), (count, total, longest) in sorted(self.timers.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+            }
+
+    def to_prometheus(self, prefix="prisma"):
+        lines = []
+        data = self.to_json()
+        for kind, items in (("summary", data["timers"]), ("counter", data["counters"])):
+            declared = set()
+            for item in items:
+                name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{item['name']}")
+                name += "_seconds" if kind == "summary" else "_total"
+                if name not in declared:
+                    lines.append(f"# TYPE {name} {kind}")
+                    declared.add(name)
+                labels = ",".join(f'{key}="{value}"' for key, value in item["labels"].items())
+                labels = "{" + labels + "}" if labels else ""
+                if kind == "summary":
+                    lines.append(f"{name}_count{labels} {item['count']}")
+                    lines.append(f"{name}_sum{labels} {item['seconds']:.6f}")
+                else:
+                    lines.append(f"{name}{labels} {item['value']:.15g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        data = self.to_json()
+        lines = [f"{'Timer':<60} {'Calls':>8} {'Total, s':>10} {'Mean, ms':>10} {'Max, ms':>10}"]
+        for item in sorted(data["timers"], key=lambda item: -item["seconds"]):
+            name = self.format_name(item["name"], item["labels"].items())
+            mean = 1000 * item["seconds"] / item["count"]
+            lines.append(
+                f"{name:<60} {item['count']:>8} {item['seconds']:>10.3f} {mean:>10.2f} {1000 * item['max_seconds']:>10.2f}"
+            )
+        lines.append("")
+        lines.append(f"{'Counter':<60} {'Value':>14}")
+        for item in data["counters"]:
+            lines.append(f"{self.format_name(item['name'], item['labels'].items()):<60} {item['value']:>14.15g}")
+        return "\n".join(lines)
+
+
+profiler = Profiler()
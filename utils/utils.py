@@ -1,6 +1,17 @@
-import pycountry
+import os
+import json
+import threading
+import numpy as np
 import pandas as pd
 
+from prisma.constants import (
+    COUNTRY_ALIASES_FILE,
+    FMP_COUNTRY_ALIASES,
+    SECTORS_COUNTRIES_DISPLAY_NUM,
+    SECTORS_COUNTRIES_MIN_WEIGHT,
+)
+from prisma.utils.profiling import profiler
+
 
 def find_name(instruments, query):
     if instruments is not None:
@@ -21,24 +32,114 @@ def find_name(instruments, query):
         return name
 
 
+class CountryResolver:
+    """
+    Resolves country names to alpha-2 codes through a precomputed alias index.
+    Fuzzy search is used only for unknown names, and its results are memoized.
+    """
+
+    def __init__(self, aliases_file=COUNTRY_ALIASES_FILE):
+        self.aliases_file = aliases_file
+        self.index = None
+        self.learned = {}
+        self.lock = threading.Lock()
+
+    def build_index(self):
+        import pycountry
+
+        index = {}
+        for country in pycountry.countries:
+            for attribute in ("alpha_2", "alpha_3", "name", "official_name", "common_name"):
+                value = getattr(country, attribute, None)
+                if value:
+                    index.setdefault(value.lower(), country.alpha_2)
+        for name, code in FMP_COUNTRY_ALIASES.items():
+            index[name.lower()] = code
+        if self.aliases_file and os.path.isfile(self.aliases_file):
+            with open(self.aliases_file, "r") as file:
+                index.update(json.load(file))
+        return index
+
+    def resolve(self, name):
+        with self.lock:
+            if self.index is None:
+                self.index = self.build_index()
+            key = name.strip().lower()
+            if key in self.index:
+                return self.index[key]
+        import pycountry
+
+        matches = pycountry.countries.search_fuzzy(name)
+        if not matches:
+            raise ValueError
+        code = matches[0].alpha_2
+        with self.lock:
+            self.index[key] = code
+            self.learned[key] = code
+        return code
+
+    def save(self):
+        """
+        Persist names resolved by fuzzy search, so that next runs find them in the index
+        """
+        with self.lock:
+            if not self.learned or not self.aliases_file:
+                return
+            aliases = {}
+            if os.path.isfile(self.aliases_file):
+                with open(self.aliases_file, "r") as file:
+                    aliases = json.load(file)
+            aliases.update(self.learned)
+            with open(self.aliases_file, "w") as file:
+                json.dump(aliases, file, indent=2, sort_keys=True)
+            self.learned = {}
+
+
+country_resolver = CountryResolver()
+
+
 def convert_countries_to_codes(countries):
-    if countries and isinstance(countries, dict):
-        codes = {}
-        for name, weight in countries.items():
-            matches = pycountry.countries.search_fuzzy(name)
-            if not matches:
-                raise ValueError
-            codes[matches[0].alpha_2] = weight
-        return codes
-    elif countries and isinstance(countries, list):
-        codes = []
-        for name in countries:
-            matches = pycountry.countries.search_fuzzy(name)
-            if not matches:
-                raise ValueError
-            codes.append(matches[0].alpha_2)
-        return codes
-    return {}
+    with profiler.timer("convert_countries_to_codes"):
+        if countries and isinstance(countries, dict):
+            codes = {}
+            for name, weight in countries.items():
+                codes[country_resolver.resolve(name)] = weight
+            return codes
+        elif countries and isinstance(countries, list):
+            return [country_resolver.resolve(name) for name in countries]
+        return {}
+
+
+def exposure_matrix(data, symbols):
+    """
+    Convert {symbol: {category: weight}} to a (symbols x categories) weight matrix
+    with a sorted category vocabulary
+    """
+    matrix = pd.DataFrame.from_dict({symbol: weights or {} for symbol, weights in data.items()}, orient="index")
+    matrix = matrix.reindex(index=symbols, columns=sorted(matrix.columns))
+    return matrix.astype(float).fillna(0.0)
+
+
+def top_categories(matrix, nlargest=SECTORS_COUNTRIES_DISPLAY_NUM, min_weight=SECTORS_COUNTRIES_MIN_WEIGHT):
+    """
+    Describe every row of a weight matrix by its largest categories, e.g. "US.6 CN.3"
+    """
+    weights = matrix.to_numpy()
+    categories = np.asarray(matrix.columns)
+    order = np.argsort(-weights, axis=1, kind="stable")[:, :nlargest]
+    top_weights = np.take_along_axis(weights, order, axis=1)
+    counts = (top_weights >= min_weight).sum(axis=1)
+
+    descriptions = []
+    for row_order, row_weights, count in zip(order, top_weights, counts):
+        top_selection = []
+        for name, weight in zip(categories[row_order[:count]], row_weights[:count]):
+            new_name = f"{name}"
+            if weight < 0.99 and count > 1:
+                new_name += f"{weight:.1f}".strip("0")
+            top_selection.append(new_name)
+        descriptions.append(" ".join(top_selection))
+    return pd.Series(descriptions, index=matrix.index)
 
 
 def percent_to_float(x):